@@ -12,15 +12,31 @@ import appdirs
 import tempfile
 from queue import Queue, Empty
 import asyncio
+from contextlib import asynccontextmanager
 import logging
 from openai import AsyncOpenAI
 from typing import Optional
 from api_keys import openai_key, DeepL
+from audio_cache import AudioCache
+from flow_control import rate_limiter
+from resilience import call_with_retry
 from concurrent.futures import ThreadPoolExecutor
 import sqlite3
 import json
 import shutil
 import subprocess
+import re
+from kobo_utils import EXPORT_ALL, export_watermarks, watermark_key
+
+
+TTS_MODEL = "tts-1"
+TTS_VOICE = "nova"
+TTS_FORMAT = "mp3"
+
+
+def bookmark_tag(bookmark_id):
+    return "kobo::" + re.sub(r'[^\w-]', '_', bookmark_id)
+
 
 class AnkiUtils:
 
@@ -36,64 +52,118 @@ class AnkiUtils:
     def get_anki_deck_path(self, deck_name):
         return os.path.join(self.get_anki_deck_dir(), f"{deck_name}.apkg")
 
-    def get_media_dir(self):
-        if self.is_standalone:
-            base_dir = appdirs.user_data_dir("KoboAnkiCreator", "YourName_HobbyProjects")
-        else:
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-        media_dir = os.path.join(base_dir, "media")
-        os.makedirs(media_dir, exist_ok=True)
-        return media_dir
-
     def create_deck(self, deck_name=None):
         random_deck_id = random.randint(int(1e9), int(1e10))
         if deck_name is None:
             deck_name = "Deck_" + datetime.datetime.now().strftime("%Y-%m-%d")
         return genanki.Deck(random_deck_id, deck_name)
 
-    def make_note(self, lang, eng, audio=None):
-        """Create a note with or without audio"""
-        if audio:
-            # With audio
-            return genanki.Note(
-                model=self.my_model,
-                fields=[lang, eng, audio]
-            )
-        else:
-            # Without audio - use empty string for the audio field
-            return genanki.Note(
-                model=self.my_model,
-                fields=[lang, eng, '']
-            )
+    def make_note(self, lang, eng, audio=None, guid=None, tags=()):
+        """
+        Create a note with or without audio.
+        Notes for Kobo highlights get a stable guid, so re-importing an edited highlight updates its card.
+        """
+        # Without audio - use empty string for the audio field
+        return genanki.Note(
+            model=self.my_model,
+            fields=[lang, eng, audio or ''],
+            guid=guid,
+            tags=list(tags)
+        )
+
+    def make_highlight_note(self, lang, eng, row, guid, audio=None):
+        """Note for a DeviceAnnotation, tagged with every bookmark it stands for; `guid` is the ledger's note_guid"""
+        bookmark_ids = [row.annotation.bookmark_id] + [annotation.bookmark_id for _, annotation in row.duplicates]
+        return self.make_note(
+            lang, eng, audio,
+            guid=guid,
+            tags=[bookmark_tag(bookmark_id) for bookmark_id in bookmark_ids]
+        )
 
-    async def async_text_to_speech(self, text, output_file, sem):
-        async with sem:
+    def delete_anki_notes_for_bookmarks(self, bookmark_ids):
+        """Remove cards for highlights deleted on the reader; returns True if AnkiConnect accepted the request"""
+        bookmark_ids = list(bookmark_ids)
+        for start in range(0, len(bookmark_ids), 100):
+            chunk = bookmark_ids[start:start + 100]
+            query = " OR ".join(f"tag:{bookmark_tag(bookmark_id)}" for bookmark_id in chunk)
             try:
-                response = await self.async_client.audio.speech.create(
-                    model="tts-1",
-                    voice="nova",
-                    input=text
-                )
-                full_output_path = os.path.join(self.get_media_dir(), output_file)
-                with open(full_output_path, 'wb') as f:
-                    f.write(response.content)
-                return True
-            except Exception as e:
-                print(f"Error creating audio for '{text}': {e}")
+                rate_limiter('ankiconnect').acquire()
+                found = self.clients.anki_connect(
+                    {"action": "findNotes", "version": 6, "params": {"query": query}}
+                ).json()
+                if found.get("error"):
+                    raise RuntimeError(found["error"])
+                if found["result"]:
+                    rate_limiter('ankiconnect').acquire()
+                    deleted = self.clients.anki_connect(
+                        {"action": "deleteNotes", "version": 6, "params": {"notes": found["result"]}}
+                    ).json()
+                    if deleted.get("error"):
+                        raise RuntimeError(deleted["error"])
+            except (requests.exceptions.RequestException, RuntimeError, ValueError) as e:
+                logging.error(f"Error deleting notes for removed highlights: {e}")
                 return False
+        return True
+
+    def create_audio_cache(self):
+        return AudioCache(os.path.join(self.get_cache_dir(), "audio"))
+
+    async def async_text_to_speech(self, text, limiter):
+        """Return the media file name holding audio for `text`, generating it only on a cache miss"""
+        # The lookup touches the cache index (an SQLite write), so keep it off the event loop
+        cached = await asyncio.to_thread(self.audio_cache.get, text, TTS_MODEL, TTS_VOICE, TTS_FORMAT)
+        if cached:
+            return cached
+
+        @asynccontextmanager
+        async def speech_slot():
+            await rate_limiter('openai').acquire_async(chars=len(text))
+            async with limiter:
+                yield
+
+        def speech_request():
+            return self.async_client.audio.speech.create(
+                model=TTS_MODEL,
+                voice=TTS_VOICE,
+                input=text,
+                response_format=TTS_FORMAT
+            )
+
+        try:
+            response = await call_with_retry(
+                speech_request,
+                name="TTS request",
+                timeout=self.tts_timeout,
+                hedge_after=self.tts_hedge_after,
+                gate=speech_slot
+            )
+            return await asyncio.to_thread(
+                self.audio_cache.put, text, TTS_MODEL, TTS_VOICE, TTS_FORMAT, response.content
+            )
+        except Exception as e:
+            logging.error(f"Error creating audio for '{text}': {e}")
+            return None
+
+    def log_audio_cache_stats(self):
+        stats = self.audio_cache.stats()
+        logging.info(
+            f"Audio cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate), {stats['bytes'] / 1024 / 1024:.1f} MiB stored"
+        )
 
     async def make_anki_cards(self, deck_name, media_list, author=None, title=None, start_date=None, end_date=None,
-                              ownpath=None):
+                              ownpath=None, mode=EXPORT_ALL):
         """Creates Anki cards from Kobo annotations"""
         # Just use the generic method with the Kobo-specific generator
-        translation_generator = self.fetch_and_translate(author, title, start_date, end_date, ownpath)
+        translation_generator = self.fetch_and_translate(author, title, start_date, end_date, ownpath, mode)
         await self.make_anki_cards_from_generator(deck_name, media_list, translation_generator)
 
     def bundle_anki_package(self, deck, media_files, deck_name):
         output_filename = self.get_anki_deck_path(deck_name)
 
         my_package = genanki.Package(deck)
-        my_package.media_files = [os.path.join(self.get_media_dir(), file) for file in media_files]
+        # Identical phrases share one content-addressed file, so each is packaged only once
+        my_package.media_files = [self.audio_cache.path_for(file) for file in dict.fromkeys(media_files)]
 
         try:
             my_package.write_to_file(output_filename)
@@ -115,20 +185,12 @@ class AnkiUtils:
 
 
     def cleanup_mp3_files(self):
-        media_dir = os.path.join(appdirs.user_data_dir("KoboAnkiCreator", "Conforti"), "media")
-        for file_name in os.listdir(media_dir):
-            if file_name.endswith('.mp3'):
-                file_path = os.path.join(media_dir, file_name)
-                try:
-                    os.remove(file_path)
-                    logging.info(f"Deleted file: {file_path}")
-                except OSError as e:
-                    logging.error(f"Error deleting file {file_path}: {e}")
+        # Audio lives on in the shared cache; just release this run's files and keep the store within budget
+        self.audio_cache.trim(keep=self.media_list)
         self.media_list.clear()
+
     def import_deck_to_anki(self, deck_path):
         abs_path = os.path.abspath(deck_path)
-        url = 'http://localhost:8765'
-        headers = {'Content-Type': 'application/json'}
         payload = {
             "action": "importPackage",
             "version": 6,
@@ -138,7 +200,8 @@ class AnkiUtils:
         }
 
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            rate_limiter('ankiconnect').acquire()
+            response = self.clients.anki_connect(payload)
             if response.status_code == 200:
                 print(f"Successfully imported deck: {deck_path}")
                 return True
@@ -159,10 +222,27 @@ class AnkiUtils:
             deck_path = self.bundle_anki_package(new_deck, self.media_list, deck_name)
             logging.info(f"Anki package bundled at {deck_path}")
 
+            if self.watermark_scope is not None:
+                author, title = self.watermark_scope
+                for device_id, (date_created, bookmark_id) in export_watermarks(self.export_outcomes).items():
+                    self.sync_state.set_watermark(watermark_key(device_id, author, title), date_created, bookmark_id)
+            self.export_outcomes = {}
+            if self.exported_entries:
+                self.export_ledger.record(self.exported_entries)
+                self.exported_entries = []
+
             # Clean up media files after the package is created
             self.cleanup_mp3_files()
 
             import_success = self.import_deck_to_anki(deck_path)
+            if import_success and self.pending_deletions:
+                # A note standing for highlights on several readers stays until every copy is gone
+                orphaned = self.export_ledger.orphaned(self.pending_deletions)
+                if not orphaned or self.delete_anki_notes_for_bookmarks(bookmark_id for _, bookmark_id in orphaned):
+                    logging.info(f"Removed cards for {len(orphaned)} of {len(self.pending_deletions)} "
+                                 f"deleted highlights")
+                    self.export_ledger.forget(self.pending_deletions)
+                self.pending_deletions = []
             if import_success:
                 logging.info("Deck imported successfully")
                 message = f"Deck creation completed and imported to Anki!\nSaved at: {deck_path}\nClick 'Open Deck Folder' to access it."
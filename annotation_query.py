@@ -0,0 +1,145 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple
+
+
+SELECT_COLUMNS = """
+    Bookmark.Text,
+    Bookmark.Annotation,
+    Bookmark.DateCreated,
+    AuthorContent.Attribution AS Author,
+    ChapterContent.BookTitle,
+    Bookmark.BookmarkID
+"""
+
+FROM_CLAUSE = """
+FROM
+    Bookmark
+INNER JOIN
+    Content AS ChapterContent ON Bookmark.ContentID = ChapterContent.ContentID
+LEFT JOIN
+    Content AS AuthorContent ON ChapterContent.BookID = AuthorContent.ContentID AND AuthorContent.BookID IS NULL
+"""
+
+ORDER_CLAUSE = "ORDER BY Bookmark.DateCreated ASC, Bookmark.BookmarkID ASC"
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+@dataclass(frozen=True)
+class AnnotationFilter:
+    """
+    Every filter the app applies to Kobo annotations. Unset fields add no condition.
+    `after` is a (DateCreated, BookmarkID) keyset cursor; rows strictly after it are returned.
+    """
+    author: Optional[str] = None
+    title: Optional[str] = None
+    titles: Tuple[str, ...] = ()
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    annotation_type: Optional[str] = None
+    has_note: Optional[bool] = None
+    text_contains: Optional[str] = None
+    after: Optional[Tuple[str, str]] = None
+    limit: Optional[int] = None
+
+    def shape(self):
+        """The part of the filter that decides the SQL text; filters with equal shapes share a statement"""
+        return (
+            bool(self.author),
+            bool(self.title),
+            len(self.titles),
+            bool(self.start_date),
+            bool(self.end_date),
+            bool(self.annotation_type),
+            self.has_note,
+            bool(self.text_contains),
+            bool(self.after),
+            self.limit is not None,
+        )
+
+    def params(self):
+        params = []
+        if self.author:
+            params.append(self.author)
+        if self.title:
+            params.append(self.title)
+        params.extend(self.titles)
+        if self.start_date:
+            params.append(self.start_date)
+        if self.end_date:
+            params.append(self.end_date)
+        if self.annotation_type:
+            params.append(self.annotation_type)
+        if self.text_contains:
+            params.append(f"%{_escape_like(self.text_contains)}%")
+        if self.after:
+            params.extend([self.after[0], self.after[0], self.after[1]])
+        if self.limit is not None:
+            params.append(self.limit)
+        return params
+
+
+@lru_cache(maxsize=None)
+def _where_clause(shape):
+    author, title, n_titles, start_date, end_date, annotation_type, has_note, text_contains, after, _ = shape
+    conditions = []
+    if author:
+        conditions.append("AuthorContent.Attribution = ?")
+    if title:
+        conditions.append("ChapterContent.BookTitle = ?")
+    if n_titles:
+        conditions.append(f"ChapterContent.BookTitle IN ({', '.join('?' * n_titles)})")
+    if start_date and end_date:
+        conditions.append("Bookmark.DateCreated BETWEEN ? AND ?")
+    elif start_date:
+        conditions.append("Bookmark.DateCreated >= ?")
+    elif end_date:
+        conditions.append("Bookmark.DateCreated <= ?")
+    if annotation_type:
+        conditions.append("Bookmark.Type = ?")
+    if has_note is True:
+        conditions.append("Bookmark.Annotation IS NOT NULL AND Bookmark.Annotation != ''")
+    elif has_note is False:
+        conditions.append("(Bookmark.Annotation IS NULL OR Bookmark.Annotation = '')")
+    if text_contains:
+        conditions.append("Bookmark.Text LIKE ? ESCAPE '\\'")
+    if after:
+        # Keyset condition on (DateCreated, BookmarkID) so highlights sharing a timestamp aren't lost
+        conditions.append("(Bookmark.DateCreated > ? OR (Bookmark.DateCreated = ? AND Bookmark.BookmarkID > ?))")
+    return ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+
+@lru_cache(maxsize=None)
+def _select_sql(shape):
+    limit = "LIMIT ?" if shape[-1] else ""
+    return f"SELECT {SELECT_COLUMNS} {FROM_CLAUSE} {_where_clause(shape)} {ORDER_CLAUSE} {limit}"
+
+
+@lru_cache(maxsize=None)
+def _count_sql(shape):
+    return f"SELECT COUNT(*) {FROM_CLAUSE} {_where_clause(shape)}"
+
+
+def select_query(annotation_filter):
+    """
+    (sql, params) for the rows matching a filter. The SQL text is memoised per filter shape, so
+    repeated queries hit sqlite3's per-connection prepared statement cache instead of re-parsing.
+    """
+    return _select_sql(annotation_filter.shape()), annotation_filter.params()
+
+
+def count_query(annotation_filter):
+    # LIMIT doesn't apply to counts, so drop its parameter
+    params = annotation_filter.params()
+    if annotation_filter.limit is not None:
+        params = params[:-1]
+    return _count_sql(annotation_filter.shape()), params
+
+
+def explain(conn, annotation_filter):
+    """EXPLAIN QUERY PLAN for this filter's shape, as a list of plan detail strings"""
+    sql, params = select_query(annotation_filter)
+    return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
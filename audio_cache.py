@@ -0,0 +1,119 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+
+class AudioCache:
+    """
+    Content-addressed store for generated TTS audio, shared by every deck.
+    Files are named after hash(text, model, voice, format) and evicted least-recently-used
+    once the store grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=500 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS audio (
+                file_name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS audio_last_used ON audio (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def file_name_for(text, model, voice, fmt):
+        digest = hashlib.sha256("\0".join((text, model, voice, fmt)).encode('utf-8')).hexdigest()
+        return f"{digest[:32]}.{fmt}"
+
+    def path_for(self, file_name):
+        return os.path.join(self.cache_dir, file_name)
+
+    def get(self, text, model, voice, fmt):
+        """Return the cached file name for this utterance, or None if it has to be generated"""
+        file_name = self.file_name_for(text, model, voice, fmt)
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE audio SET last_used = ? WHERE file_name = ?", (time.time(), file_name)
+            )
+            self._conn.commit()
+            if cursor.rowcount and os.path.exists(self.path_for(file_name)):
+                self.hits += 1
+                return file_name
+            self.misses += 1
+            return None
+
+    def put(self, text, model, voice, fmt, content):
+        file_name = self.file_name_for(text, model, voice, fmt)
+        path = self.path_for(file_name)
+        # Write to a temporary name first so a crash never leaves a truncated file under a valid key
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO audio (file_name, size, last_used) VALUES (?, ?, ?)",
+                (file_name, len(content), time.time())
+            )
+            self._conn.commit()
+        return file_name
+
+    def total_bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM audio").fetchone()[0]
+
+    def trim(self, keep=()):
+        """Evict least-recently-used files until the store fits its budget, never touching `keep`"""
+        keep = set(keep)
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM audio").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            evicted = []
+            for file_name, size in self._conn.execute("SELECT file_name, size FROM audio ORDER BY last_used ASC"):
+                if total <= self.max_bytes:
+                    break
+                if file_name in keep:
+                    continue
+                evicted.append(file_name)
+                total -= size
+
+            for file_name in evicted:
+                try:
+                    os.remove(self.path_for(file_name))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.error(f"Error deleting cached audio {file_name}: {e}")
+            self._conn.executemany("DELETE FROM audio WHERE file_name = ?", [(f,) for f in evicted])
+            self._conn.commit()
+
+        logging.info(f"Evicted {len(evicted)} files from audio cache")
+        return len(evicted)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'bytes': self.total_bytes(),
+        }
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
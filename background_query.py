@@ -0,0 +1,80 @@
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Channel:
+    __slots__ = ('executor', 'generation', 'timer', 'future')
+
+    def __init__(self, name):
+        # One worker per channel: queries of one kind run in order, and a queued one can still be cancelled
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"query-{name}")
+        self.generation = 0
+        self.timer = None
+        self.future = None
+
+
+class BackgroundQueries:
+    """
+    Runs UI-triggered queries off the Tk main thread, latest request wins.
+    Requests on the same channel are debounced, a request that hasn't started yet is cancelled when
+    a newer one arrives, and the result of one that was already running is dropped. Results and
+    errors are delivered on the Tk thread via root.after.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def _channel(self, name):
+        with self._lock:
+            if name not in self._channels:
+                self._channels[name] = _Channel(name)
+            return self._channels[name]
+
+    def submit(self, channel_name, query, on_result, on_error=None, delay_ms=0):
+        """Run `query()` on the channel's worker after `delay_ms` of quiet, then call on_result(result)"""
+        channel = self._channel(channel_name)
+        generation = self._supersede(channel)
+
+        def start():
+            channel.timer = None
+            channel.future = channel.executor.submit(run)
+
+        def run():
+            try:
+                result = query()
+            except Exception as e:
+                if generation == channel.generation:
+                    logging.debug(f"Background query on {channel_name} failed: {e}")
+                    if on_error is not None:
+                        self.root.after(0, deliver, on_error, e)
+                return
+            self.root.after(0, deliver, on_result, result)
+
+        def deliver(callback, value):
+            # Superseded while it ran or while waiting for the Tk thread
+            if generation == channel.generation:
+                callback(value)
+
+        if delay_ms:
+            channel.timer = self.root.after(delay_ms, start)
+        else:
+            start()
+
+    def _supersede(self, channel):
+        """Invalidate whatever the channel has pending or running; returns the new generation"""
+        channel.generation += 1
+        if channel.timer is not None:
+            self.root.after_cancel(channel.timer)
+            channel.timer = None
+        if channel.future is not None:
+            channel.future.cancel()
+        return channel.generation
+
+    def shutdown(self):
+        with self._lock:
+            channels = list(self._channels.values())
+        for channel in channels:
+            channel.executor.shutdown(wait=False, cancel_futures=True)
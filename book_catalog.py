@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+import time
+import logging
+from typing import NamedTuple, Optional
+
+
+CATALOG_SQL = """
+SELECT
+    Content.Title AS Book,
+    Content.Attribution AS Author,
+    Content.___SyncTime,
+    COALESCE(SUM(Highlights.Count), 0),
+    MAX(Highlights.LastCreated)
+FROM
+    Content
+LEFT JOIN
+    (SELECT VolumeID, COUNT(*) AS Count, MAX(DateCreated) AS LastCreated FROM Bookmark GROUP BY VolumeID)
+    AS Highlights ON Highlights.VolumeID = Content.ContentID
+WHERE
+    Content.DateLastRead IS NOT NULL AND
+    Content.Title IS NOT NULL AND
+    Content.Attribution IS NOT NULL
+GROUP BY
+    Content.Title, Content.Attribution, Content.___SyncTime
+"""
+
+SORT_KEYS = {
+    'Author': lambda book: (book.author, book.title),
+    'Book': lambda book: (book.title, book.author),
+    'Date Added': lambda book: (book.date_added or '', book.title),
+}
+
+
+class Book(NamedTuple):
+    title: str
+    author: str
+    date_added: Optional[str]
+    highlight_count: int
+    last_highlight: Optional[str]
+
+
+class BookCatalog:
+    """
+    The device's book list with highlight counts and last-highlight dates, loaded with one aggregate
+    query per snapshot. Sort orders are computed in memory and kept until the snapshot changes.
+    Each freshly loaded catalog is saved to `path`, so the next launch can show it before any reader
+    is attached.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.saved_at = None
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._books = []
+        self._sorted = {}
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    def load(self, conn, snapshot):
+        """Re-query only when `snapshot` (the snapshot identity) differs from the one loaded"""
+        with self._lock:
+            if snapshot != self._snapshot:
+                self._books = [Book._make(row) for row in conn.execute(CATALOG_SQL)]
+                self._sorted = {}
+                self._snapshot = snapshot
+                self._save()
+            return self._books
+
+    def restore(self):
+        """Load the catalog saved by a previous session; True if there was one"""
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+            books = [Book(*row) for row in saved['books']]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.error(f"Could not read saved catalog {self.path}: {e}")
+            return False
+        with self._lock:
+            if self._snapshot is not None:
+                # A live load already happened
+                return False
+            self._books = books
+            self._sorted = {}
+            self._snapshot = saved.get('snapshot')
+            self.saved_at = saved.get('saved_at')
+        return True
+
+    def sorted_by(self, sort_by):
+        with self._lock:
+            if sort_by not in self._sorted:
+                self._sorted[sort_by] = sorted(self._books, key=SORT_KEYS[sort_by])
+            return self._sorted[sort_by]
+
+    def _save(self):
+        if self.path is None:
+            return
+        self.saved_at = time.time()
+        state = {'snapshot': self._snapshot, 'saved_at': self.saved_at, 'books': [list(book) for book in self._books]}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"Could not save catalog {self.path}: {e}")
@@ -0,0 +1,99 @@
+import importlib.util
+import threading
+import logging
+import deepl
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from openai import AsyncOpenAI
+
+
+ANKI_CONNECT_URL = 'http://localhost:8765'
+
+# HTTP/2 needs the optional h2 package; fall back to pooled HTTP/1.1 keep-alive without it
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+OPENAI_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+ANKI_CONNECT_TIMEOUT = (3.05, 120)
+DEEPL_TIMEOUT = 60.0
+
+
+class ClientRegistry:
+    """
+    Long-lived, pooled provider clients shared by every run for the lifetime of the app.
+    Clients are keyed by API key, so editing a key in the UI transparently builds a new one.
+    AsyncOpenAI clients are bound to the event loop they are first used on, so callers must
+    always use them from the app's persistent loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._openai = {}
+        self._deepl = {}
+        self._anki_session = None
+
+    def openai(self, api_key):
+        with self._lock:
+            if api_key not in self._openai:
+                http_client = httpx.AsyncClient(
+                    http2=HTTP2_AVAILABLE,
+                    timeout=OPENAI_TIMEOUT,
+                    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=120)
+                )
+                # Retries are handled by call_with_retry, which also feeds the adaptive limiter
+                self._openai[api_key] = AsyncOpenAI(api_key=api_key, max_retries=0, http_client=http_client)
+            return self._openai[api_key]
+
+    def deepl(self, api_key, timeout=DEEPL_TIMEOUT):
+        with self._lock:
+            # The deepl package configures these module-wide. Retries are handled by call_with_retry,
+            # and the client's own socket timeout bounds each request, since a thread can't be cancelled.
+            deepl.http_client.max_network_retries = 0
+            deepl.http_client.min_connection_timeout = timeout
+            if api_key not in self._deepl:
+                self._deepl[api_key] = deepl.Translator(api_key)
+            return self._deepl[api_key]
+
+    def anki_session(self):
+        with self._lock:
+            if self._anki_session is None:
+                session = requests.Session()
+                session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+                session.headers.update({'Content-Type': 'application/json'})
+                self._anki_session = session
+            return self._anki_session
+
+    def anki_connect(self, payload):
+        return self.anki_session().post(ANKI_CONNECT_URL, json=payload, timeout=ANKI_CONNECT_TIMEOUT)
+
+    def prewarm_sync(self, deepl_key=None):
+        """Open DeepL and AnkiConnect connections ahead of the first run (blocking, call off the UI thread)"""
+        if deepl_key:
+            try:
+                self.deepl(deepl_key).get_usage()
+            except Exception as e:
+                logging.debug(f"DeepL pre-warm failed: {e}")
+        try:
+            self.anki_session().post(ANKI_CONNECT_URL, json={"action": "version", "version": 6}, timeout=(1, 2))
+        except requests.exceptions.RequestException as e:
+            logging.debug(f"AnkiConnect pre-warm failed: {e}")
+
+    async def prewarm_async(self, openai_key=None):
+        """Open the OpenAI connection pool; must run on the app's persistent event loop"""
+        if not openai_key:
+            return
+        try:
+            await self.openai(openai_key).models.list()
+        except Exception as e:
+            logging.debug(f"OpenAI pre-warm failed: {e}")
+
+    async def aclose(self):
+        for client in list(self._openai.values()):
+            await client.close()
+        self._openai.clear()
+        for translator in self._deepl.values():
+            translator.close()
+        self._deepl.clear()
+        if self._anki_session is not None:
+            self._anki_session.close()
+            self._anki_session = None
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+
+import genanki
+
+
+def content_hash(text, annotation):
+    return hashlib.sha1(f"{text or ''}\0{annotation or ''}".encode('utf-8')).hexdigest()
+
+
+def copies_of(row):
+    """Every (device_id, Annotation) a merged DeviceAnnotation stands for"""
+    return [(row.device_id, row.annotation), *row.duplicates]
+
+
+def ledger_entries(row, guid):
+    """Entries for ExportLedger.record: every copy of the highlight, exported as note `guid`"""
+    return [
+        (device_id, annotation.bookmark_id, content_hash(annotation.text, annotation.annotation), guid)
+        for device_id, annotation in copies_of(row)
+    ]
+
+
+@dataclass
+class ChangeSet:
+    added: set = field(default_factory=set)
+    changed: set = field(default_factory=set)
+    deleted: list = field(default_factory=list)
+
+    @property
+    def pending(self):
+        """Bookmark IDs that need a (new or updated) card"""
+        return self.added | self.changed
+
+
+class ExportLedger:
+    """
+    Record of every highlight already turned into a card: bookmark ID, content hash and the note's
+    guid per device. Diffing it against the device's current highlights yields what was added, edited
+    or deleted since the last export. The same highlight on several readers shares one guid, so its
+    note keeps its identity whichever reader is plugged in, and survives until every copy is deleted.
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS exported (
+                device_id TEXT NOT NULL,
+                bookmark_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                exported_at REAL NOT NULL,
+                guid TEXT,
+                PRIMARY KEY (device_id, bookmark_id)
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(exported)")]
+        if 'guid' not in columns:
+            self._conn.execute("ALTER TABLE exported ADD COLUMN guid TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS exported_guid ON exported (guid)")
+        self._conn.commit()
+
+    def diff(self, device_id, annotations):
+        """Single pass over the device's current highlights, classifying each against the ledger"""
+        with self._lock:
+            exported = dict(self._conn.execute(
+                "SELECT bookmark_id, content_hash FROM exported WHERE device_id = ?", (device_id,)
+            ))
+        changes = ChangeSet()
+        for annotation in annotations:
+            previous = exported.pop(annotation.bookmark_id, None)
+            if previous is None:
+                changes.added.add(annotation.bookmark_id)
+            elif previous != content_hash(annotation.text, annotation.annotation):
+                changes.changed.add(annotation.bookmark_id)
+        changes.deleted = list(exported)
+        return changes
+
+    def guid_for(self, entries):
+        """The guid already given to any of these (device_id, bookmark_id) highlights, or None"""
+        with self._lock:
+            for device_id, bookmark_id in entries:
+                row = self._conn.execute(
+                    "SELECT guid FROM exported WHERE device_id = ? AND bookmark_id = ? AND guid IS NOT NULL",
+                    (device_id, bookmark_id)
+                ).fetchone()
+                if row is not None:
+                    return row[0]
+        return None
+
+    def note_guid(self, row):
+        """
+        The guid for a DeviceAnnotation's note: the one an earlier export gave any of its copies,
+        whichever reader that was, so Anki updates that note; else one derived from this reader.
+        """
+        guid = self.guid_for((device_id, annotation.bookmark_id) for device_id, annotation in copies_of(row))
+        return guid or genanki.guid_for(row.device_id, row.annotation.bookmark_id)
+
+    def record(self, entries):
+        """entries: iterable of (device_id, bookmark_id, content_hash, guid) that made it into a written deck"""
+        now = time.time()
+        # Built before taking the lock, since the entries may be produced by calls back into the ledger
+        rows = [(device_id, bookmark_id, digest, now, guid) for device_id, bookmark_id, digest, guid in entries]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO exported (device_id, bookmark_id, content_hash, exported_at, guid) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def orphaned(self, entries):
+        """
+        Of the (device_id, bookmark_id) highlights about to be forgotten, those whose note no remaining
+        highlight still stands for, i.e. the ones whose notes can be deleted.
+        """
+        entries = list(entries)
+        leaving = set(entries)
+        orphaned = []
+        with self._lock:
+            for device_id, bookmark_id in entries:
+                row = self._conn.execute(
+                    "SELECT guid FROM exported WHERE device_id = ? AND bookmark_id = ?", (device_id, bookmark_id)
+                ).fetchone()
+                if row is None or row[0] is None:
+                    orphaned.append((device_id, bookmark_id))
+                    continue
+                sharing = self._conn.execute("SELECT device_id, bookmark_id FROM exported WHERE guid = ?", (row[0],))
+                if all(tuple(other) in leaving for other in sharing):
+                    orphaned.append((device_id, bookmark_id))
+        return orphaned
+
+    def forget(self, entries):
+        """entries: iterable of (device_id, bookmark_id)"""
+        entries = list(entries)
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM exported WHERE device_id = ? AND bookmark_id = ?", entries)
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+import logging
+
+
+# Steady-state provider limits. None disables that dimension for the provider.
+RATE_LIMITS = {
+    'deepl': {'requests_per_minute': 600, 'chars_per_minute': 1_000_000},
+    'openai': {'requests_per_minute': 50, 'chars_per_minute': 200_000},
+    'ankiconnect': {'requests_per_minute': 60, 'chars_per_minute': None},
+}
+
+
+def is_overload_error(exc):
+    """True for errors that mean the provider wants us to slow down (429, 5xx, timeouts)"""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    status = getattr(exc, 'status_code', None) or getattr(exc, 'http_status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(exc).__name__ in ('RateLimitError', 'APITimeoutError', 'APIConnectionError', 'TooManyRequestsException')
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit, used as an async context manager around each provider call.
+    The limit grows by one per window of successful calls that finish under target_latency and is
+    cut multiplicatively on overload errors or slow responses, staying within [floor, ceiling].
+    """
+
+    def __init__(self, initial=2, floor=1, ceiling=16, target_latency=5.0, backoff=0.5, name="tts"):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.name = name
+        self._limit = float(max(floor, min(initial, ceiling)))
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+        self._last_decrease = 0.0
+        self._started = {}
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        self._started[asyncio.current_task()] = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        latency = time.monotonic() - self._started.pop(asyncio.current_task(), time.monotonic())
+        if exc is not None and is_overload_error(exc):
+            self._decrease(latency)
+        elif exc is None:
+            if latency > self.target_latency:
+                self._decrease(latency)
+            else:
+                self._limit = min(self.ceiling, self._limit + 1 / self._limit)
+
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+        return False
+
+    def _decrease(self, latency):
+        # Calls already in flight when we backed off report the same congestion; count it once
+        now = time.monotonic()
+        if now - self._last_decrease < latency:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self._limit = max(self.floor, self._limit * self.backoff)
+        if self.limit != previous:
+            logging.info(f"{self.name} concurrency reduced from {previous} to {self.limit}")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute, bursting to ten seconds' worth.
+    Callers reserve tokens up front and are told how long to wait, so waiting never holds the lock.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, rate_per_minute / 6)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, cost=1):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Going negative queues this caller behind earlier reservations rather than letting it jump ahead
+            self._tokens -= cost
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RateLimiter:
+    """Request and character budgets for one provider, usable from threads and coroutines alike"""
+
+    def __init__(self, name, requests_per_minute=None, chars_per_minute=None):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.chars = TokenBucket(chars_per_minute) if chars_per_minute else None
+
+    def _reserve(self, chars):
+        delay = 0.0
+        if self.requests:
+            delay = max(delay, self.requests.reserve(1))
+        if self.chars and chars:
+            delay = max(delay, self.chars.reserve(chars))
+        if delay > 1:
+            logging.debug(f"{self.name} rate limit reached, waiting {delay:.1f}s")
+        return delay
+
+    def acquire(self, chars=0):
+        delay = self._reserve(chars)
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self, chars=0):
+        delay = self._reserve(chars)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def rate_limiter(provider):
+    """Return the process-wide RateLimiter for a provider named in RATE_LIMITS"""
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            _rate_limiters[provider] = RateLimiter(provider, **RATE_LIMITS[provider])
+        return _rate_limiters[provider]
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import logging
+from kobo_db import Annotation
+
+
+def _content_hash(annotation):
+    parts = (annotation.text, annotation.annotation, annotation.book_title, annotation.author)
+    return hashlib.sha1("\0".join(part or '' for part in parts).encode('utf-8')).hexdigest()
+
+
+def fts_query(user_query):
+    """
+    Turn free text into an FTS5 MATCH expression: "quoted phrases" are matched exactly and
+    every other word as a prefix, so typing "mai" already finds "maison".
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\S+)', user_query):
+        if phrase:
+            terms.append('"' + phrase.replace('"', '""') + '"')
+        else:
+            word = word.replace('"', '')
+            if word:
+                terms.append('"' + word + '"*')
+    return " ".join(terms)
+
+
+class HighlightIndex:
+    """
+    Local FTS5 mirror of Bookmark.Text, Annotation, book title and author for ranked search.
+    It is refreshed incrementally from the Kobo snapshot: only highlights whose content hash
+    changed are rewritten, and a sync is skipped entirely while the snapshot is unchanged.
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS highlights (
+                id INTEGER PRIMARY KEY,
+                device_id TEXT NOT NULL,
+                bookmark_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                date_created TEXT,
+                UNIQUE (device_id, bookmark_id)
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS highlights_fts USING fts5(
+                text, annotation, title, author,
+                tokenize = 'unicode61 remove_diacritics 2'
+            );
+            CREATE TABLE IF NOT EXISTS sync_state (
+                device_id TEXT PRIMARY KEY,
+                snapshot TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def is_current(self, device_id, snapshot):
+        with self._lock:
+            row = self._conn.execute("SELECT snapshot FROM sync_state WHERE device_id = ?", (device_id,)).fetchone()
+        return row is not None and row[0] == snapshot
+
+    def sync(self, device_id, snapshot, annotations):
+        """Bring the index for one device in line with `annotations`, the device's full highlight list"""
+        with self._lock, self._conn:
+            existing = {
+                bookmark_id: (row_id, content_hash)
+                for row_id, bookmark_id, content_hash in self._conn.execute(
+                    "SELECT id, bookmark_id, content_hash FROM highlights WHERE device_id = ?", (device_id,)
+                )
+            }
+            added = changed = 0
+            for annotation in annotations:
+                content_hash = _content_hash(annotation)
+                current = existing.pop(annotation.bookmark_id, None)
+                if current is not None and current[1] == content_hash:
+                    continue
+
+                fields = (annotation.text or '', annotation.annotation or '', annotation.book_title or '',
+                          annotation.author or '')
+                if current is None:
+                    row_id = self._conn.execute(
+                        "INSERT INTO highlights (device_id, bookmark_id, content_hash, date_created) VALUES (?, ?, ?, ?)",
+                        (device_id, annotation.bookmark_id, content_hash, annotation.date_created)
+                    ).lastrowid
+                    added += 1
+                else:
+                    row_id = current[0]
+                    self._conn.execute(
+                        "UPDATE highlights SET content_hash = ?, date_created = ? WHERE id = ?",
+                        (content_hash, annotation.date_created, row_id)
+                    )
+                    self._conn.execute("DELETE FROM highlights_fts WHERE rowid = ?", (row_id,))
+                    changed += 1
+                self._conn.execute(
+                    "INSERT INTO highlights_fts (rowid, text, annotation, title, author) VALUES (?, ?, ?, ?, ?)",
+                    (row_id, *fields)
+                )
+
+            # Whatever is left no longer exists on the device
+            removed = [(row_id,) for row_id, _ in existing.values()]
+            self._conn.executemany("DELETE FROM highlights_fts WHERE rowid = ?", removed)
+            self._conn.executemany("DELETE FROM highlights WHERE id = ?", removed)
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (device_id, snapshot) VALUES (?, ?)", (device_id, snapshot)
+            )
+        logging.info(f"Highlight index synced: {added} added, {changed} changed, {len(removed)} removed")
+
+    def search(self, user_query, limit=200, device_id=None):
+        """Best-matching highlights first, ranked by bm25"""
+        match = fts_query(user_query)
+        if not match:
+            return []
+        sql = """
+            SELECT f.text, f.annotation, h.date_created, f.author, f.title, h.bookmark_id
+            FROM highlights_fts AS f
+            JOIN highlights AS h ON h.id = f.rowid
+            WHERE highlights_fts MATCH ?
+        """
+        params = [match]
+        if device_id is not None:
+            sql += " AND h.device_id = ?"
+            params.append(device_id)
+        sql += " ORDER BY bm25(highlights_fts) LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [Annotation._make(row) for row in self._conn.execute(sql, params)]
@@ -1,28 +1,45 @@
 import tkinter as tk
 from tkinter import messagebox
-import deepl
 import datetime
 import genanki
 import os
 from queue import Queue
 import asyncio
 import logging
-from openai import AsyncOpenAI
+import threading
 from api_keys import openai_key, DeepL
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
 import appdirs
 import sys
 from ui import UI
 from kobo_utils import KoboUtils
 from anki_utils import AnkiUtils
-
-
-class KoboAnkiCreator(UI, KoboUtils, AnkiUtils):
+from translation_utils import TranslationUtils
+from flow_control import AdaptiveConcurrency
+from clients import ClientRegistry
+from sync_state import SyncState
+from kobo_snapshot import SnapshotStore
+from kobo_db import KoboDatabase
+from mount_watcher import MountWatcher
+from highlight_index import HighlightIndex
+from book_catalog import BookCatalog
+from export_ledger import ExportLedger, ledger_entries
+from progress_events import ProgressBus, TotalKnown, Translated, CardDone, PhaseComplete, RunDone, start_log_sink
+
+
+class KoboAnkiCreator(UI, KoboUtils, AnkiUtils, TranslationUtils):
     def __init__(self):
         self.root = tk.Tk()
+        # One long-lived loop for every run, so pooled async clients survive between runs
         self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
-        self.task_queue = Queue()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, name="asyncio", daemon=True)
+        self.loop_thread.start()
+        self.clients = ClientRegistry()
+        # Progress goes to the Tk UI losslessly (bounded, so producers wait if it falls behind) and to the log
+        self.progress_bus = ProgressBus()
+        self.ui_events = self.progress_bus.subscribe(maxsize=4096)
+        self.progress_log = start_log_sink(self.progress_bus)
         self.error_queue = Queue()
         self.is_running = False
         self.executor = ThreadPoolExecutor()
@@ -30,12 +47,41 @@ class KoboAnkiCreator(UI, KoboUtils, AnkiUtils):
         self.processed_cards = {}
         self.current_progress = 0
         self.current_phase = "Translation"
+        self.translated_count = 0
         self.total_cards = 0
+        self.progress_dirty = False
+        self.last_progress_render = 0.0
+        self.translation_concurrency = 4
+        self.pipeline_workers = 16
+        self.tts_concurrency_floor = 2
+        self.tts_concurrency_ceiling = 16
+        self.tts_limiter = None
+        self.current_run = None
+        self.translation_timeout = 60.0
+        self.translation_hedge_after = None
+        self.tts_timeout = 60.0
+        self.tts_hedge_after = 30.0
+        self.pipeline_queue_size = 64
         self.use_tts = tk.BooleanVar(value=True)  # Add this to track TTS status
 
         self.async_client = None
         self.translator = None
         self.is_standalone = self._is_running_as_standalone()
+        self.translation_cache = self.create_translation_cache()
+        self.audio_cache = self.create_audio_cache()
+        self.mount_watcher = MountWatcher()
+        self.kobo_db = KoboDatabase()
+        self.snapshots = SnapshotStore(os.path.join(self.get_cache_dir(), 'snapshots'))
+        self.highlight_index = HighlightIndex(os.path.join(self.get_cache_dir(), 'highlights.sqlite'))
+        self.book_catalog = BookCatalog(os.path.join(self.get_cache_dir(), 'catalog.json'))
+        self.known_mountpoints = []
+        self.sync_state = SyncState(os.path.join(self.get_user_data_dir(), 'sync_state.json'))
+        # Durable: the only record of which notes exist in Anki, so it must survive clearing the cache
+        self.export_ledger = ExportLedger(os.path.join(self.get_user_data_dir(), 'export_ledger.sqlite'))
+        self.export_outcomes = {}
+        self.watermark_scope = None
+        self.pending_deletions = []
+        self.exported_entries = []
 
         # Keep the existing CSS and model definition
         self.my_css = """
@@ -73,31 +119,53 @@ class KoboAnkiCreator(UI, KoboUtils, AnkiUtils):
 
         self.setup_ui()
         self.load_api_keys()
+        self.prewarm_clients()
+        self.watch_for_devices()
+
+    def prewarm_clients(self):
+        """Open provider connections in the background so the first run skips TLS setup"""
+        deepl_api_key = self.deepl_key_entry.get() or DeepL
+        openai_api_key = self.openai_key_entry.get() or openai_key
+        self.executor.submit(self.clients.prewarm_sync, deepl_api_key)
+        asyncio.run_coroutine_threadsafe(self.clients.prewarm_async(openai_api_key), self.loop)
+
+    def shutdown(self):
+        self.is_running = False
+        if self.loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(self.clients.aclose(), self.loop).result(timeout=5)
+            except Exception as e:
+                logging.debug(f"Error closing clients: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.mount_watcher.close()
+        self.progress_bus.unsubscribe(self.progress_log)
+        self.background.shutdown()
+        self.executor.shutdown(wait=False)
 
-    def process_text_file(self, file_path):
+    async def process_text_file(self, file_path):
         """Process a text file with words/phrases and yield translations"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = [line.strip() for line in f.readlines() if line.strip()]
+            lines = await asyncio.to_thread(self.read_text_file, file_path)
+        except Exception as e:
+            logging.error(f"Error processing text file: {e}")
+            messagebox.showerror("Error", f"Failed to process text file: {str(e)}")
+            yield 1, 1, "Error", f"Failed to process file: {str(e)}", None
+            return
 
-            total_lines = len(lines)
-            for index, original in enumerate(lines, 1):
+        total_lines = len(lines)
+        index = 0
+        async with aclosing(self.atranslate_texts(lines)) as translations:
+            async for original, translation in translations:
+                index += 1
                 if not self.is_running:
                     break
 
-                try:
-                    # Translate the line
-                    translation = self.translator.translate_text(original, target_lang="EN-US").text
-                    yield index, total_lines, original, translation
-                except Exception as e:
-                    logging.error(f"Error translating line '{original}': {e}")
-                    # Yield the original text as both source and translation if translation fails
-                    yield index, total_lines, original, f"[Translation failed: {str(e)}]"
+                yield index, total_lines, original, translation, None
+
+    def read_text_file(self, file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f.readlines() if line.strip()]
 
-        except Exception as e:
-            logging.error(f"Error processing text file: {e}")
-            messagebox.showerror("Error", f"Failed to process text file: {str(e)}")
-            yield 1, 1, "Error", f"Failed to process file: {str(e)}"
     def _is_running_as_standalone(self):
         return getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS')
 
@@ -126,8 +194,15 @@ class KoboAnkiCreator(UI, KoboUtils, AnkiUtils):
         self.is_running = True
         self.processed_cards = {}
         self.current_progress = 0
-        self.current_phase = "Translation"
+        self.current_phase = "Text-to-Speech" if self.use_tts.get() else "Processing Cards"
+        self.translated_count = 0
+        self.progress_dirty = False
+        # Leftovers from an aborted run
+        self.ui_events.drain()
         self.media_list = []
+        self.translation_cache.enabled = self.use_translation_cache.get()
+        self.translation_cache.reset_stats()
+        self.audio_cache.reset_stats()
 
         deepl_api_key = self.deepl_key_entry.get() or DeepL
 
@@ -145,7 +220,7 @@ class KoboAnkiCreator(UI, KoboUtils, AnkiUtils):
                 self.is_running = False
                 return
             try:
-                self.async_client = AsyncOpenAI(api_key=openai_api_key)
+                self.async_client = self.clients.openai(openai_api_key)
             except Exception as e:
                 messagebox.showerror("API Error", f"Failed to initialize OpenAI client: {str(e)}")
                 self.is_running = False
@@ -154,7 +229,7 @@ class KoboAnkiCreator(UI, KoboUtils, AnkiUtils):
             self.async_client = None  # No OpenAI client needed
 
         try:
-            self.translator = deepl.Translator(deepl_api_key)
+            self.translator = self.clients.deepl(deepl_api_key, timeout=self.translation_timeout)
         except Exception as e:
             messagebox.showerror("API Error", f"Failed to initialize DeepL translator: {str(e)}")
             self.is_running = False
@@ -179,10 +254,16 @@ class KoboAnkiCreator(UI, KoboUtils, AnkiUtils):
         source_text = "imported text" if self.source_var.get() == "import" else "Kobo annotations"
         phase_text = f"Creating cards from {source_text}" + (" with audio" if self.use_tts.get() else " without audio")
         self.listbox.delete(0, tk.END)
+        self.reset_preview()
         self.progress_bar["value"] = 0
         self.progress_label.config(text=f"{phase_text}...")
 
         new_deck = self.create_deck(deck_name)
+        export_mode = self.export_mode.get()
+        self.export_outcomes = {}
+        self.watermark_scope = None
+        self.pending_deletions = []
+        self.exported_entries = []
 
         self.deck_button.config(state=tk.DISABLED)
         self.abort_button.config(state=tk.NORMAL)
@@ -208,9 +289,13 @@ class KoboAnkiCreator(UI, KoboUtils, AnkiUtils):
                     start_date = self.start_date_picker.get()
                     end_date = self.end_date_picker.get()
 
-                    await self.make_anki_cards(new_deck, self.media_list, author, title, start_date, end_date)
+                    await self.make_anki_cards(new_deck, self.media_list, author, title, start_date, end_date,
+                                               mode=export_mode)
 
                 logging.info("Finished making cards")
+                self.log_translation_cache_stats()
+                if self.use_tts.get():
+                    self.log_audio_cache_stats()
 
                 if self.is_running:
                     logging.info("Starting post_processing")
@@ -226,74 +311,108 @@ class KoboAnkiCreator(UI, KoboUtils, AnkiUtils):
                 self.root.after(0, lambda: self.abort_button.config(state=tk.DISABLED))
                 self.root.after(0, lambda: self.deck_button.config(state=tk.NORMAL))
 
-        def run_async_main():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(main())
-            finally:
-                loop.close()
-
-        self.executor.submit(run_async_main)
+        self.current_run = asyncio.run_coroutine_threadsafe(main(), self.loop)
         self.root.after(100, self.check_error_queue)
         self.root.after(100, self.update_ui)
         logging.info("run_all completed")
 
     async def make_anki_cards_from_generator(self, deck_name, media_list, translation_generator):
         """
-        Creates Anki cards from any generator that yields (index, total, original, translation)
-        This is used for both Kobo annotations and imported text files
+        Creates Anki cards from any async generator that yields (index, total, original, translation, annotation)
+        This is used for both Kobo annotations and imported text files; `annotation` is the source Kobo
+        highlight as a DeviceAnnotation, or None for imported text.
+        A translation may be the exception it failed with after retries; those rows are left out of the deck.
+
+        Translation and card creation run as a pipeline: each translated row is handed to a pool of
+        card workers through a bounded queue, so TTS starts as soon as the first row is translated.
         """
-        modified_rows = []
-        sem = asyncio.Semaphore(2)
+        rows = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        tts_limiter = AdaptiveConcurrency(
+            initial=self.tts_concurrency_floor,
+            floor=self.tts_concurrency_floor,
+            ceiling=self.tts_concurrency_ceiling
+        )
+        self.tts_limiter = tts_limiter
         total = 0
 
-        for index, total, original, translation in translation_generator:
-            if not self.is_running:
-                break
-            if index == 1:
-                self.task_queue.put(("TOTAL", total, 0, total))
-
-            self.task_queue.put(("TRANSLATE", original, translation, index, total))
-            modified_rows.append((original, translation))
+        async def produce():
+            nonlocal total
+            try:
+                async for index, total, original, translation, annotation in translation_generator:
+                    if not self.is_running:
+                        break
+                    if index == 1:
+                        await self.progress_bus.apublish(TotalKnown(total))
 
-        if not self.is_running:
-            return
+                    await self.progress_bus.apublish(Translated(index, total))
+                    await rows.put((index, (original, translation), annotation))
 
-        self.task_queue.put(("PHASE_COMPLETE", "Translation", total, total))
+                if self.is_running:
+                    await self.progress_bus.apublish(PhaseComplete("Translation", total))
+            finally:
+                # Also stops the streaming cursor and any translation batches still in flight
+                await translation_generator.aclose()
+            # Only reached on normal completion: after an abort or error there's nobody left to read these
+            for _ in range(self.pipeline_workers):
+                await rows.put(None)
 
-        async def process_row(index, row):
+        async def process_row(index, row, annotation):
             if not self.is_running:
                 return
             lang, eng = row
 
+            if isinstance(eng, Exception):
+                logging.error(f"Skipping '{lang}', translation failed: {eng}")
+                if annotation is not None:
+                    self.export_outcomes[index] = (annotation, False)
+                await self.progress_bus.apublish(
+                    CardDone(self.current_phase, lang, f"[Skipped, translation failed: {eng}]", index, total)
+                )
+                return
+
+            audio = None
             if self.use_tts.get() and self.async_client:
                 # Only create audio if TTS is enabled and OpenAI client is available
-                file_name = f'{lang.replace(" ", "_")[:16]}.mp3'
-                formatted_file_name = f'[sound:{file_name}]'
-                media_list.append(file_name)
-
-                success = await self.async_text_to_speech(lang, file_name, sem)
-                if success:
-                    note = self.make_note(lang, eng, formatted_file_name)
-                else:
-                    # Create note without audio if TTS failed
-                    note = self.make_note(lang, eng)
+                file_name = await self.async_text_to_speech(lang, tts_limiter)
+                if file_name:
+                    media_list.append(file_name)
+                    audio = f'[sound:{file_name}]'
+                # Otherwise the note is created without audio
+
+            if annotation is not None:
+                guid = await asyncio.to_thread(self.export_ledger.note_guid, annotation)
+                note = self.make_highlight_note(lang, eng, annotation, guid, audio)
+                self.exported_entries.extend(ledger_entries(annotation, guid))
+                # Watermarks only advance over rows that made it into the deck
+                self.export_outcomes[index] = (annotation, True)
             else:
-                # Create note without audio
-                note = self.make_note(lang, eng)
+                note = self.make_note(lang, eng, audio)
 
             deck_name.add_note(note)
 
-            # Update the task phase description based on whether TTS is enabled
-            task_phase = "TTS" if self.use_tts.get() else "Processing"
-            self.task_queue.put((task_phase, lang, eng, index, total))
+            await self.progress_bus.apublish(CardDone(self.current_phase, lang, eng, index, total))
+
+        async def consume():
+            while True:
+                item = await rows.get()
+                if item is None:
+                    return
+                await process_row(*item)
+
+        tasks = [asyncio.create_task(produce()), *(asyncio.create_task(consume()) for _ in range(self.pipeline_workers))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # On abort or a failed row, make sure no stage is left waiting on the queue
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-        tasks = [process_row(i, row) for i, row in enumerate(modified_rows, 1)]
-        await asyncio.gather(*tasks)
+        if self.use_tts.get() and self.async_client:
+            logging.info(f"TTS concurrency settled at {tts_limiter.limit}")
 
         if self.is_running:
-            self.task_queue.put(("DONE", "DONE", total, total))
+            await self.progress_bus.apublish(RunDone(total))
 
     def abort_process(self):
         logging.info("Abort process initiated")
@@ -303,8 +422,8 @@ class KoboAnkiCreator(UI, KoboUtils, AnkiUtils):
         self.abort_button.config(state=tk.DISABLED)
         self.deck_button.config(state=tk.NORMAL)
 
-        for task in asyncio.all_tasks(self.loop):
-            task.cancel()
+        if self.current_run is not None:
+            self.current_run.cancel()
 
         self.executor.shutdown(wait=False)
         self.executor = ThreadPoolExecutor()
@@ -0,0 +1,116 @@
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple, Optional
+from urllib.parse import quote
+
+READ_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+class Annotation(NamedTuple):
+    text: str
+    annotation: Optional[str]
+    date_created: str
+    author: Optional[str]
+    book_title: Optional[str]
+    bookmark_id: str
+
+
+class KoboSource(NamedTuple):
+    """One annotation database: a mounted reader's KoboReader.sqlite or a manually chosen file"""
+    db_path: Path
+    device_id: str
+
+
+class DeviceAnnotation(NamedTuple):
+    """An annotation tagged with the device it came from, plus the same highlight found on other devices"""
+    device_id: str
+    annotation: Annotation
+    duplicates: tuple = ()
+
+
+class _Entry:
+    __slots__ = ('lock', 'conn', 'identity')
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.conn = None
+        self.identity = None
+
+
+class KoboDatabase:
+    """
+    One shared read-only connection per Kobo snapshot.
+    A snapshot file is never modified in place, so it is opened with immutable=1, which lets SQLite
+    skip locking and change detection entirely. A connection is reopened whenever its snapshot
+    identity changes and dropped when the device goes away. Each snapshot has its own lock, so
+    several devices can be queried in parallel.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._by_conn = {}
+
+    def _open(self, path):
+        uri = f"file:{quote(str(path))}?mode=ro&immutable=1"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        for pragma in READ_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _entry(self, path):
+        with self._lock:
+            if path not in self._entries:
+                self._entries[path] = _Entry()
+            return self._entries[path]
+
+    @contextmanager
+    def connection(self, path, identity):
+        """Yield the shared connection for `path`, holding it exclusively for the duration of the block"""
+        entry = self._entry(path)
+        with entry.lock:
+            if entry.conn is None or entry.identity != identity:
+                self._close(entry)
+                logging.debug(f"Opening read-only Kobo database {path}")
+                entry.conn = self._open(path)
+                entry.identity = identity
+                with self._lock:
+                    self._by_conn[entry.conn] = entry
+            yield entry.conn
+
+    def identity_of(self, conn):
+        with self._lock:
+            return self._by_conn[conn].identity
+
+    def fetch_chunk(self, cursor, size):
+        """fetchmany under the connection's lock, so a streaming cursor can interleave with other queries"""
+        with self._lock:
+            entry = self._by_conn.get(cursor.connection)
+        if entry is None:
+            raise sqlite3.ProgrammingError("Kobo database connection was closed")
+        with entry.lock:
+            return cursor.fetchmany(size)
+
+    def invalidate(self, keep=()):
+        """Close connections to every snapshot except those in `keep`"""
+        with self._lock:
+            entries = [entry for path, entry in self._entries.items() if path not in keep]
+        for entry in entries:
+            with entry.lock:
+                self._close(entry)
+
+    def _close(self, entry):
+        if entry.conn is not None:
+            with self._lock:
+                self._by_conn.pop(entry.conn, None)
+            entry.conn.close()
+        entry.conn = None
+        entry.identity = None
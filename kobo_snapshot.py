@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import logging
+from urllib.parse import quote
+
+# The 100-byte SQLite header includes the file change counter, so it changes on every committed write
+SQLITE_HEADER_SIZE = 100
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        header = f.read(SQLITE_HEADER_SIZE)
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'header_sha1': hashlib.sha1(header).hexdigest(),
+    }
+
+
+class SnapshotStore:
+    """
+    Local copies of Kobo databases. Each source is copied with the SQLite online-backup API into the
+    cache directory, and the copy is reused until the source's size, mtime or header checksum change.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._source_locks = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, source_id):
+        name = hashlib.sha1(source_id.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{name}.sqlite"), os.path.join(self.cache_dir, f"{name}.json")
+
+    def _source_lock(self, source_id):
+        # One lock per source, so several devices can be copied at the same time
+        with self._lock:
+            if source_id not in self._source_locks:
+                self._source_locks[source_id] = threading.Lock()
+            return self._source_locks[source_id]
+
+    def snapshot(self, source_path, source_id):
+        """Return (local snapshot path, signature), refreshing the copy only if the source changed"""
+        source_path = str(source_path)
+        local_path, meta_path = self._paths(source_id)
+        signature = file_signature(source_path)
+
+        with self._source_lock(source_id):
+            if os.path.exists(local_path) and os.path.exists(meta_path):
+                try:
+                    with open(meta_path, 'r') as f:
+                        if json.load(f) == signature:
+                            return local_path, signature
+                except (OSError, ValueError):
+                    pass
+
+            logging.info(f"Copying {source_path} to local snapshot {local_path}")
+            tmp_path = f"{local_path}.tmp"
+            # mode=ro so reading the device never creates a journal next to it
+            source = sqlite3.connect(f"file:{quote(source_path)}?mode=ro", uri=True)
+            target = sqlite3.connect(tmp_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            os.replace(tmp_path, local_path)
+
+            with open(meta_path, 'w') as f:
+                json.dump(signature, f)
+            return local_path, signature
@@ -1,205 +1,371 @@
 from pathlib import Path
-import tkinter as tk
-from tkinter import messagebox
-from typing import Optional
-import sqlite3
-import json
-import shutil
-import subprocess
+from typing import List, NamedTuple, Optional
+from dataclasses import replace
+import heapq
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import aclosing, contextmanager
+from kobo_db import Annotation, DeviceAnnotation, KoboSource
+from translation_cache import normalize_text
+import annotation_query
+from annotation_query import AnnotationFilter
 
 
+ANNOTATION_CHUNK_SIZE = 256
+PREVIEW_PAGE_SIZE = 200
+# Everything that refills the listbox shares one background channel, so a newer request supersedes older ones
+PREVIEW_CHANNEL = "preview"
+LIBRARY_CHANNEL = "library"
+DEVICE_CHANNEL = "device"
+DEVICE_POLL_MS = 2000
 
-class KoboUtils:
-    def get_kobo_mountpoint(self, label: str = 'KOBOeReader') -> Optional[Path]:
-        has_lsblk = shutil.which('lsblk')
-        if has_lsblk:  # on Linux
-            xxx = subprocess.check_output(['lsblk', '-f', '--json']).decode('utf8')
-            jj = json.loads(xxx)
-            devices = [d for d in jj['blockdevices'] if d.get('label', None) == label]
-            kobos = []
-            for d in devices:
-                mp = d.get('mountpoint')
-                if mp is not None:
-                    kobos.append(mp)
-                mps = d.get('mountpoints')
-                if mps is not None:
-                    assert all(p is not None for p in mps), (mps, d)
-                    kobos.extend(mps)
-        else:
-            output = subprocess.check_output(('df', '-Hl')).decode('utf8')
-            output_parts = [o.split() for o in output.split('\n')]
-            kobos = [o[-1] for o in output_parts if f'/Volumes/{label}' in o]
-
-        if len(kobos) > 1:
-            raise RuntimeError(f'Multiple Kobo devices detected: {kobos}')
-        elif len(kobos) == 0:
-            return None
-        else:
-            [kobo] = kobos
-            return Path(kobo)
+EXPORT_ALL = "All matching highlights"
+EXPORT_NEW = "Only new highlights"
+EXPORT_CHANGED = "New & edited highlights"
 
-    def fetch_books_and_authors(self, sort_by='Author', ownpath=None):
-        if ownpath is None:
-            kobo_path = self.get_kobo_mountpoint()
-            if kobo_path is None:
-                messagebox.showerror("Error", "No Kobo device detected")
-                return
-            conn = sqlite3.connect(kobo_path / '.kobo' / 'KoboReader.sqlite')
-        else:
-            conn = sqlite3.connect(ownpath)
-        cursor = conn.cursor()
-
-        if sort_by == 'Author':
-            sort_column = 'Content.Attribution'
-        elif sort_by == 'Book':
-            sort_column = 'Content.Title'
-        elif sort_by == 'Date Added':
-            sort_column = 'Content.___SyncTime'
-
-        query = f"""
-        SELECT DISTINCT
-            Content.Title AS Book,
-            Content.Attribution AS Author,
-            Content.___SyncTime 
-        FROM 
-            Content 
-        WHERE
-            Content.DateLastRead IS NOT NULL AND
-            Content.Title IS NOT NULL AND
-            Content.Attribution IS NOT NULL
-        ORDER BY 
-            {sort_column} ASC
-        """
 
-        cursor.execute(query)
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
+class KoboNotFoundError(RuntimeError):
+    pass
 
-        self.listbox.delete(0, tk.END)
 
-        header = f"{'Author':<30} | {'Book':<40} | {'Date Added':<20}"
-        self.listbox.insert(tk.END, header)
-        self.listbox.insert(tk.END, "-" * len(header))
+class AnnotationPage(NamedTuple):
+    annotations: List[Annotation]
+    total: int
+    # Filter for the following page, or None when this is the last one
+    next_filter: Optional[AnnotationFilter]
 
-        for result in results:
-            author = result[1]#[:28] + '..' if len(result[1]) > 30 else result[1]
-            book = result[0] #[:38] + '..' if len(result[0]) > 40 else result[0]
-            date_added = result[2][:19]
 
-            formatted_line = f"{author:<30} | {book:<40} | {date_added:<20}"
-            self.listbox.insert(tk.END, formatted_line)
+class KoboUtils:
+    def get_kobo_mountpoints(self, label: str = 'KOBOeReader') -> List[Path]:
+        return [Path(kobo) for kobo in self.mount_watcher.mountpoints(label)]
+
+    def get_kobo_sources(self, ownpath=None) -> List[KoboSource]:
+        """Every annotation database to read: the manually chosen file, or each mounted reader"""
+        if ownpath is not None:
+            return [KoboSource(Path(ownpath), f"file:{os.path.abspath(ownpath)}")]
+        sources = []
+        for kobo_path in self.get_kobo_mountpoints():
+            db_path = kobo_path / '.kobo' / 'KoboReader.sqlite'
+            sources.append(KoboSource(db_path, self.device_id_for(db_path)))
+        return sources
+
+    def resolve_source(self, ownpath=None) -> KoboSource:
+        """The single source behind views that show one library; with several readers, the first one"""
+        if isinstance(ownpath, KoboSource):
+            return ownpath
+        sources = self.get_kobo_sources(ownpath)
+        if not sources:
+            # Device unplugged: drop connections to stale snapshots
+            self.kobo_db.invalidate()
+            raise KoboNotFoundError("No Kobo device detected")
+        if len(sources) > 1:
+            logging.info(f"Multiple Kobo devices detected, showing {sources[0].db_path}")
+        return sources[0]
+
+    @contextmanager
+    def kobo_connection(self, ownpath=None):
+        """
+        Shared read-only connection to a fast local snapshot of a Kobo database.
+        `ownpath` may be a database path, a KoboSource, or None for the mounted reader.
+        """
+        source = self.resolve_source(ownpath)
+        local_path, signature = self.snapshots.snapshot(source.db_path, source.device_id)
+        identity = (local_path, signature['size'], signature['mtime_ns'], signature['header_sha1'])
+        with self.kobo_db.connection(local_path, identity) as conn:
+            yield conn
 
-        self.listbox.config(font=("Courier", 16))
+    def fetch_books_and_authors(self, sort_by='Author', ownpath=None):
+        """Load the book list on a background worker and show it when it arrives"""
+        self.background.submit(
+            PREVIEW_CHANNEL,
+            lambda: self.query_books_and_authors(sort_by, ownpath),
+            self.display_books_and_authors,
+            on_error=self.show_query_error
+        )
+
+    def query_books_and_authors(self, sort_by='Author', ownpath=None):
+        """
+        The catalog in `sort_by` order; only a new snapshot costs a database query. With no reader
+        attached, the catalog already in memory (e.g. the one restored at launch) is re-sorted instead.
+        """
+        try:
+            with self.kobo_connection(ownpath) as conn:
+                # repr, so the key survives the JSON round trip of the saved catalog
+                self.book_catalog.load(conn, repr(self.kobo_db.identity_of(conn)))
+        except KoboNotFoundError:
+            if ownpath is not None or not self.book_catalog.loaded:
+                raise
+        return self.book_catalog.sorted_by(sort_by)
+
+    def display_books_and_authors(self, books):
+        self.reset_preview()
+        self.showing_catalog = True
+
+        header = f"{'Author':<30} | {'Book':<40} | {'Date Added':<20} | {'Highlights':>10} | {'Last Highlight':<14}"
+        self.listbox.set_rows([header, "-" * len(header)] + list(books), formatter=format_book_line)
+
+    def show_saved_catalog(self):
+        """Render the catalog saved by the last session, so the window is useful before a reader is found"""
+        if not self.book_catalog.restore():
+            return
+        self.display_books_and_authors(self.book_catalog.sorted_by(self.sort_option.get()))
+        saved_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(self.book_catalog.saved_at or 0))
+        self.preview_label.config(text=f"Library as of {saved_at}")
+
+    def watch_for_devices(self):
+        """Poll the (cached) mount table off the Tk thread and refresh the library when a reader appears"""
+        self.background.submit(DEVICE_CHANNEL, self.get_kobo_mountpoints, self.on_devices_polled,
+                               on_error=lambda e: self.on_devices_polled(self.known_mountpoints))
+
+    def on_devices_polled(self, mountpoints):
+        appeared = mountpoints and mountpoints != self.known_mountpoints
+        self.known_mountpoints = mountpoints
+        if appeared:
+            logging.info(f"Kobo detected at {mountpoints[0]}, refreshing library")
+            self.background.submit(LIBRARY_CHANNEL, lambda: self.refresh_library(self.sort_option.get()),
+                                   self.on_library_refreshed)
+        self.root.after(DEVICE_POLL_MS, self.watch_for_devices)
+
+    def refresh_library(self, sort_by):
+        """Bring the catalog and the offline search index up to date with the attached reader"""
+        books = self.query_books_and_authors(sort_by)
+        self.sync_highlight_index()
+        return books
+
+    def on_library_refreshed(self, books):
+        # Don't replace an annotation preview or run output the user is looking at
+        if self.showing_catalog or self.listbox.size() == 0:
+            self.display_books_and_authors(books)
 
     def fetch_books_and_authors_with_sort(self):
         sort_by = self.sort_option.get()
         self.fetch_books_and_authors(sort_by)
 
-    def fetch_annotations(self, author=None, title=None, start_date=None, end_date=None, ownpath=None):
-        if ownpath is None:
-            conn = sqlite3.connect(self.get_kobo_mountpoint() / '.kobo' / 'KoboReader.sqlite')
-        else:
-            conn = sqlite3.connect(ownpath)
-        cursor = conn.cursor()
-
-        query = """
-        SELECT 
-            Bookmark.Text,
-            Bookmark.Annotation,
-            Bookmark.DateCreated,
-            AuthorContent.Attribution AS Author,
-            ChapterContent.BookTitle
-        FROM 
-            Bookmark
-        INNER JOIN 
-            Content AS ChapterContent ON Bookmark.ContentID = ChapterContent.ContentID
-        LEFT JOIN 
-            Content AS AuthorContent ON ChapterContent.BookID = AuthorContent.ContentID AND AuthorContent.BookID IS NULL
-        WHERE
-            1=1
+    def device_id_for(self, db_path):
+        try:
+            # .kobo/version starts with the device serial number
+            serial = (db_path.parent / 'version').read_text().split(',')[0].strip()
+        except OSError:
+            serial = None
+        return f"kobo:{serial or db_path.parent.parent}"
+
+    def query_annotations(self, annotation_filter, ownpath=None):
+        sql, params = annotation_query.select_query(annotation_filter)
+        with self.kobo_connection(ownpath) as conn:
+            return [Annotation._make(row) for row in conn.execute(sql, params)]
+
+    def fetch_annotations(self, author=None, title=None, start_date=None, end_date=None, ownpath=None, after=None):
+        annotation_filter = AnnotationFilter(author=author or None, title=title or None,
+                                             start_date=start_date or None, end_date=end_date or None, after=after)
+        return self.query_annotations(annotation_filter, ownpath)
+
+    def fetch_annotation_page(self, annotation_filter, ownpath=None, page_size=PREVIEW_PAGE_SIZE, total=None):
         """
-
-        params = []
-
-        if author:
-            query += " AND AuthorContent.Attribution = ?"
-            params.append(author)
-
-        if title:
-            query += " AND ChapterContent.BookTitle = ?"
-            params.append(title)
-
-        if start_date and end_date:
-            query += " AND Bookmark.DateCreated BETWEEN ? AND ?"
-            params.append(start_date)
-            params.append(end_date)
-
-        query += " ORDER BY Bookmark.DateCreated ASC"
-
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
-
-        return results
-
-
-
-    def fetch_and_translate(self, author=None, title=None, start_date=None, end_date=None, ownpath=None):
-        if ownpath is None:
-            conn = sqlite3.connect(self.get_kobo_mountpoint() / '.kobo' / 'KoboReader.sqlite')
-        else:
-            conn = sqlite3.connect(ownpath)
-        cursor = conn.cursor()
-
-        query = """
-        SELECT 
-            Bookmark.Text,
-            Bookmark.Annotation,
-            Bookmark.DateCreated,
-            AuthorContent.Attribution AS Author,
-            ChapterContent.BookTitle
-        FROM 
-            Bookmark
-        INNER JOIN 
-            Content AS ChapterContent ON Bookmark.ContentID = ChapterContent.ContentID
-        LEFT JOIN 
-            Content AS AuthorContent ON ChapterContent.BookID = AuthorContent.ContentID AND AuthorContent.BookID IS NULL
-        WHERE
-            1=1
+        One page of matching annotations, keyed on a (DateCreated, BookmarkID) cursor so later pages
+        cost the same as the first. The total is counted only for the first page; pass it back in after.
         """
-
-        params = []
-
-        if author:
-            query += " AND AuthorContent.Attribution = ?"
-            params.append(author)
-
-        if title:
-            query += " AND ChapterContent.BookTitle = ?"
-            params.append(title)
-
-        if start_date and end_date:
-            query += " AND Bookmark.DateCreated BETWEEN ? AND ?"
-            params.append(start_date)
-            params.append(end_date)
-
-        query += " ORDER BY Bookmark.DateCreated ASC"
-
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        cursor.close()
-
-        modified_rows = []
-        for index, result in enumerate(results, 1):
-            original_text = result[0]
-            translation = self.translator.translate_text(original_text, target_lang="EN-US").text
-
-            modified_row = result[:1] + (translation,) + result[1:]
-            modified_rows.append(modified_row)
-
-            yield index, len(results), original_text, translation
-
-        return modified_rows
-
+        if total is None:
+            total = self.count_annotations(annotation_filter, ownpath)
+        # One extra row tells whether another page exists without a second query
+        annotations = self.query_annotations(replace(annotation_filter, limit=page_size + 1), ownpath)
+        next_filter = None
+        if len(annotations) > page_size:
+            annotations = annotations[:page_size]
+            last = annotations[-1]
+            next_filter = replace(annotation_filter, after=(last.date_created, last.bookmark_id))
+        return AnnotationPage(annotations, total, next_filter)
+
+    def count_annotations(self, annotation_filter, ownpath=None):
+        sql, params = annotation_query.count_query(annotation_filter)
+        with self.kobo_connection(ownpath) as conn:
+            return conn.execute(sql, params).fetchone()[0]
+
+    def explain_annotation_query(self, annotation_filter, ownpath=None):
+        with self.kobo_connection(ownpath) as conn:
+            return annotation_query.explain(conn, annotation_filter)
+
+    async def aiter_annotations(self, annotation_filter, ownpath=None, chunk_size=ANNOTATION_CHUNK_SIZE):
+        """Stream matching annotations in fetchmany chunks, with every database read done off the event loop"""
+        sql, params = annotation_query.select_query(annotation_filter)
+
+        def open_cursor():
+            with self.kobo_connection(ownpath) as conn:
+                return conn.execute(sql, params)
+
+        cursor = await asyncio.to_thread(open_cursor)
+        try:
+            while True:
+                rows = await asyncio.to_thread(self.kobo_db.fetch_chunk, cursor, chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield Annotation._make(row)
+        finally:
+            cursor.close()
+
+    def sync_highlight_index(self, ownpath=None):
+        """Refresh the local full-text index from the snapshot if the snapshot changed since the last sync"""
+        source = self.resolve_source(ownpath)
+        device_id = source.device_id
+        with self.kobo_connection(source) as conn:
+            snapshot = repr(self.kobo_db.identity_of(conn)[1:])
+            if not self.highlight_index.is_current(device_id, snapshot):
+                sql, params = annotation_query.select_query(AnnotationFilter())
+                self.highlight_index.sync(device_id, snapshot, map(Annotation._make, conn.execute(sql, params)))
+        return device_id
+
+    def search_highlights(self, user_query, ownpath=None, limit=200):
+        try:
+            device_id = self.sync_highlight_index(ownpath)
+        except KoboNotFoundError:
+            # No reader attached: search everything indexed while one was
+            device_id = None
+        return self.highlight_index.search(user_query, limit=limit, device_id=device_id)
+
+    def diff_export_ledger(self, source):
+        """Compare every highlight currently on the device with what has already been exported"""
+        sql, params = annotation_query.select_query(AnnotationFilter())
+        with self.kobo_connection(source) as conn:
+            return self.export_ledger.diff(source.device_id, map(Annotation._make, conn.execute(sql, params)))
+
+    def annotation_filter_for(self, source, author, title, start_date, end_date, mode):
+        after = None
+        if mode != EXPORT_ALL:
+            # The watermark / ledger replaces the date range in these modes
+            start_date = end_date = None
+        if mode == EXPORT_NEW:
+            after = self.sync_state.get_watermark(watermark_key(source.device_id, author, title))
+        return AnnotationFilter(author=author or None, title=title or None,
+                                start_date=start_date or None, end_date=end_date or None, after=after)
+
+    def collect_device_annotations(self, source, author=None, title=None, start_date=None, end_date=None,
+                                   mode=EXPORT_ALL):
+        """
+        Everything one device contributes to an export, as (DeviceAnnotation list, deletions).
+        Runs on a worker thread per device, so snapshot copies and queries proceed in parallel.
+        """
+        annotation_filter = self.annotation_filter_for(source, author, title, start_date, end_date, mode)
+        annotations = self.query_annotations(annotation_filter, source)
+        deletions = []
+        if mode == EXPORT_CHANGED:
+            changes = self.diff_export_ledger(source)
+            logging.info(f"Export ledger for {source.device_id}: {len(changes.added)} added, "
+                         f"{len(changes.changed)} changed, {len(changes.deleted)} deleted")
+            annotations = [annotation for annotation in annotations if annotation.bookmark_id in changes.pending]
+            deletions = [(source.device_id, bookmark_id) for bookmark_id in changes.deleted]
+        return [DeviceAnnotation(source.device_id, annotation) for annotation in annotations], deletions
+
+    async def fetch_and_translate(self, author=None, title=None, start_date=None, end_date=None, ownpath=None,
+                                  mode=EXPORT_ALL):
+        """
+        Yield (index, total, original, translation, DeviceAnnotation) for the highlights selected by `mode`:
+        everything matching the filters, only highlights past each device's watermark, or only highlights
+        added or edited since they were last exported. With several readers plugged in, each is extracted
+        in parallel and the results are merged into one date-ordered, de-duplicated stream.
+        """
+        sources = await asyncio.to_thread(self.get_kobo_sources, ownpath)
+        if not sources:
+            raise KoboNotFoundError("No Kobo device detected")
+        # Watermarks only move in "new highlights" mode, and each author/title filter keeps its own
+        self.watermark_scope = (author or None, title or None) if mode == EXPORT_NEW else None
+
+        if len(sources) == 1 and mode != EXPORT_CHANGED:
+            # Single reader: stream straight from the database without materialising the result set
+            [source] = sources
+            annotation_filter = self.annotation_filter_for(source, author, title, start_date, end_date, mode)
+            total = await asyncio.to_thread(self.count_annotations, annotation_filter, source)
+
+            async def rows():
+                async with aclosing(self.aiter_annotations(annotation_filter, source)) as annotations:
+                    async for annotation in annotations:
+                        yield DeviceAnnotation(source.device_id, annotation)
+        else:
+            extracted = await asyncio.gather(*(
+                asyncio.to_thread(self.collect_device_annotations, source, author, title, start_date, end_date, mode)
+                for source in sources
+            ))
+            merged = merge_device_annotations([annotations for annotations, _ in extracted])
+            self.pending_deletions = [deletion for _, deletions in extracted for deletion in deletions]
+            total = len(merged)
+
+            async def rows():
+                for row in merged:
+                    yield row
+
+        # Translation preserves input order, so rows queued here line up with its results
+        queued = deque()
+
+        async def texts():
+            async with aclosing(rows()) as source_rows:
+                async for row in source_rows:
+                    queued.append(row)
+                    yield row.annotation.text
+
+        index = 0
+        # Closing each stage explicitly releases the database cursor as soon as a run is aborted
+        async with aclosing(self.atranslate_texts(texts())) as translations:
+            async for original_text, translation in translations:
+                index += 1
+                row = queued.popleft()
+                yield index, total, original_text, translation, row
+
+
+def watermark_key(device_id, author=None, title=None):
+    """Sync-state key for a device's watermark; a filtered export has its own, since it skips other books"""
+    if not author and not title:
+        return device_id
+    return f"{device_id}|author={author or ''}|title={title or ''}"
+
+
+def export_watermarks(outcomes):
+    """
+    Per device, the (DateCreated, BookmarkID) of the newest highlight such that it and every earlier one
+    from that device became a note. `outcomes` maps stream index to (DeviceAnnotation, became a note).
+    A failed row holds its devices' watermarks back, and a gap (a row never processed) stops everything.
+    """
+    watermarks = {}
+    blocked = set()
+    for index in range(1, max(outcomes, default=0) + 1):
+        if index not in outcomes:
+            break
+        row, noted = outcomes[index]
+        for device_id, annotation in ((row.device_id, row.annotation), *row.duplicates):
+            if device_id in blocked:
+                continue
+            if noted:
+                watermarks[device_id] = (annotation.date_created, annotation.bookmark_id)
+            else:
+                blocked.add(device_id)
+    return watermarks
+
+
+def format_book_line(book):
+    return (f"{book.author:<30} | {book.title:<40} | {(book.date_added or '')[:19]:<20} | "
+            f"{book.highlight_count:>10} | {(book.last_highlight or '')[:10]:<14}")
+
+
+def merge_device_annotations(per_device):
+    """
+    Merge per-device lists (each already in date order) into one date-ordered list. The same highlight
+    found on several readers is folded into the first occurrence's `duplicates`; identical highlights
+    on one reader are distinct bookmarks and stay separate rows.
+    """
+    merged = []
+    seen = {}
+    ordered = heapq.merge(*per_device, key=lambda row: (row.annotation.date_created or '', row.annotation.bookmark_id))
+    for row in ordered:
+        key = (normalize_text(row.annotation.text or ''), row.annotation.book_title)
+        positions = seen.setdefault(key, [])
+        for position in positions:
+            kept = merged[position]
+            devices = {kept.device_id, *(device_id for device_id, _ in kept.duplicates)}
+            if row.device_id not in devices:
+                merged[position] = kept._replace(duplicates=kept.duplicates + ((row.device_id, row.annotation),))
+                break
+        else:
+            positions.append(len(merged))
+            merged.append(row)
+    return merged
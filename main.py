@@ -33,8 +33,7 @@ if __name__ == "__main__":
         logging.error(f"An unexpected error occurred in the main loop: {e}", exc_info=True)
         app.cleanup_mp3_files()
     finally:
+        app.shutdown()
         logging.info("Application closed.")
-        if app.loop.is_running():
-            app.loop.close()
 
 
@@ -0,0 +1,116 @@
+import os
+import re
+import select
+import threading
+import logging
+
+MOUNTINFO = '/proc/self/mountinfo'
+UDEV_DATA_DIR = '/run/udev/data'
+
+
+def _unescape(field):
+    # mountinfo escapes space, tab, newline and backslash as \ooo octal sequences
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def parse_mountinfo(text):
+    """Return [(source device, mount point)] from the contents of /proc/<pid>/mountinfo"""
+    mounts = []
+    for line in text.splitlines():
+        fields = line.split(' ')
+        try:
+            separator = fields.index('-')
+        except ValueError:
+            continue
+        if len(fields) < separator + 3:
+            continue
+        mounts.append((_unescape(fields[separator + 2]), _unescape(fields[4])))
+    return mounts
+
+
+def _udev_label(device):
+    """Filesystem label udev recorded for a block device, or None if it isn't known"""
+    try:
+        rdev = os.stat(device).st_rdev
+        with open(os.path.join(UDEV_DATA_DIR, f"b{os.major(rdev)}:{os.minor(rdev)}"), 'r') as f:
+            for line in f:
+                if line.startswith('E:ID_FS_LABEL='):
+                    return line[len('E:ID_FS_LABEL='):].rstrip('\n')
+    except OSError:
+        pass
+    return None
+
+
+class MountWatcher:
+    """
+    Finds mounted volumes by label without spawning lsblk/df.
+    On Linux the parsed mount table is cached and only re-read when the kernel flags
+    /proc/self/mountinfo as changed (POLLPRI/POLLERR on an open descriptor). Elsewhere it checks
+    /Volumes/<label>, which is a single stat call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fd = None
+        self._poller = None
+        self._mounts = None
+        if os.path.exists(MOUNTINFO):
+            try:
+                self._fd = os.open(MOUNTINFO, os.O_RDONLY)
+                self._poller = select.poll()
+                self._poller.register(self._fd, select.POLLPRI | select.POLLERR)
+            except OSError as e:
+                logging.warning(f"Cannot watch {MOUNTINFO}: {e}")
+                self._fd = None
+
+    def _read_mountinfo(self):
+        # Reading through the watched descriptor is what re-arms the change notification
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(self._fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks).decode('utf-8', errors='replace')
+
+    def _changed(self):
+        return bool(self._poller.poll(0))
+
+    def mounts(self):
+        with self._lock:
+            if self._mounts is None or self._changed():
+                self._mounts = parse_mountinfo(self._read_mountinfo())
+            return self._mounts
+
+    def mountpoints(self, label):
+        """
+        All mount points of volumes carrying `label`. Several readers share the same label, so each
+        mounted block device's label is read from the udev database (/dev/disk/by-label keeps only one
+        symlink per label). Without udev data, mount points named after the label count, including the
+        "KOBOeReader1" / "KOBOeReader 1" names desktops give a second volume.
+        """
+        if self._fd is None:
+            try:
+                names = sorted(os.listdir('/Volumes'))
+            except OSError:
+                return []
+            return [os.path.join('/Volumes', name) for name in names
+                    if name.startswith(label) and os.path.ismount(os.path.join('/Volumes', name))]
+
+        found = []
+        for source, mountpoint in self.mounts():
+            device_label = _udev_label(source) if source.startswith('/dev/') else None
+            if device_label is not None:
+                matches = device_label == label
+            else:
+                matches = os.path.basename(mountpoint).startswith(label)
+            if matches and mountpoint not in found:
+                found.append(mountpoint)
+        return found
+
+    def close(self):
+        if self._fd is not None:
+            self._poller.unregister(self._fd)
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import ClassVar
+
+
+@dataclass(slots=True)
+class ProgressEvent:
+    # Coalescing events only carry "latest state", so a newer one replaces an undelivered older one
+    coalesce: ClassVar[bool] = False
+
+
+@dataclass(slots=True)
+class TotalKnown(ProgressEvent):
+    total: int
+
+
+@dataclass(slots=True)
+class Translated(ProgressEvent):
+    coalesce: ClassVar[bool] = True
+    index: int
+    total: int
+
+
+@dataclass(slots=True)
+class CardDone(ProgressEvent):
+    """A card was created (or skipped, if its translation failed); cards finish out of order"""
+    phase: str
+    original: str
+    translation: str
+    index: int
+    total: int
+
+
+@dataclass(slots=True)
+class PhaseComplete(ProgressEvent):
+    phase: str
+    total: int
+
+
+@dataclass(slots=True)
+class RunDone(ProgressEvent):
+    total: int
+
+
+class Subscription:
+    """
+    One consumer's bounded buffer. A lossless subscription makes publishers wait while it is full;
+    a lossy one drops its oldest event instead, so slow sinks never hold up the pipeline.
+    Coalescing events take at most one slot, at the position of the first undelivered one.
+    """
+
+    def __init__(self, maxsize, lossless):
+        self.maxsize = maxsize
+        self.lossless = lossless
+        self.dropped = 0
+        self._buffer = deque()
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._not_empty = threading.Condition(self._lock)
+        self.closed = False
+
+    def offer(self, event):
+        """Buffer `event`; False only when a lossless subscription is full"""
+        with self._lock:
+            kind = type(event)
+            if event.coalesce and kind in self._latest:
+                self._latest[kind] = event
+                return True
+            if len(self._buffer) >= self.maxsize:
+                if self.lossless:
+                    return False
+                self._pop()
+                self.dropped += 1
+            if event.coalesce:
+                self._latest[kind] = event
+                self._buffer.append(kind)
+            else:
+                self._buffer.append(event)
+            self._not_empty.notify()
+            return True
+
+    def wait_not_full(self, timeout):
+        with self._lock:
+            if len(self._buffer) >= self.maxsize and not self.closed:
+                self._not_full.wait(timeout)
+
+    def _pop(self):
+        item = self._buffer.popleft()
+        if isinstance(item, type):
+            return self._latest.pop(item)
+        return item
+
+    def drain(self, max_items=None):
+        """Every buffered event (up to max_items) without blocking"""
+        with self._lock:
+            count = len(self._buffer) if max_items is None else min(max_items, len(self._buffer))
+            events = [self._pop() for _ in range(count)]
+            if events:
+                self._not_full.notify_all()
+            return events
+
+    def get(self, timeout=None):
+        """Next event, or None after `timeout` seconds or once the subscription is closed"""
+        with self._lock:
+            if not self._buffer and not self.closed:
+                self._not_empty.wait(timeout)
+            if not self._buffer:
+                return None
+            event = self._pop()
+            self._not_full.notify_all()
+            return event
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._not_full.notify_all()
+            self._not_empty.notify_all()
+
+
+class ProgressBus:
+    """Fans each progress event out to every subscription"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []
+
+    def subscribe(self, maxsize=1024, lossless=True):
+        subscription = Subscription(maxsize, lossless)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.remove(subscription)
+        subscription.close()
+
+    def publish(self, event):
+        """Publish from a plain thread, blocking while a lossless subscriber is full"""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            while not subscription.offer(event) and not subscription.closed:
+                subscription.wait_not_full(0.1)
+
+    async def apublish(self, event):
+        """Publish from the event loop; waiting on a full subscriber happens off the loop"""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            while not subscription.offer(event) and not subscription.closed:
+                await asyncio.to_thread(subscription.wait_not_full, 0.1)
+
+
+def start_log_sink(bus, interval=10):
+    """
+    Log run progress from a daemon thread: totals, phase changes, and every `interval` percent of cards.
+    It subscribes lossily, so it can never slow the pipeline down.
+    """
+    subscription = bus.subscribe(maxsize=256, lossless=False)
+
+    def run():
+        completed = 0
+        next_report = interval
+        while not subscription.closed:
+            event = subscription.get(timeout=1)
+            if isinstance(event, TotalKnown):
+                completed, next_report = 0, interval
+                logging.info(f"Run started: {event.total} items")
+            elif isinstance(event, CardDone):
+                completed += 1
+                percent = 100 * completed // max(event.total, 1)
+                if percent >= next_report:
+                    logging.info(f"{event.phase}: {completed}/{event.total} cards ({percent}%)")
+                    next_report = (percent // interval + 1) * interval
+            elif isinstance(event, PhaseComplete):
+                logging.info(f"{event.phase} complete: {event.total} items")
+            elif isinstance(event, RunDone):
+                logging.info(f"Run finished: {event.total} items")
+
+    threading.Thread(target=run, name="progress-log", daemon=True).start()
+    return subscription
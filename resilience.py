@@ -0,0 +1,92 @@
+import asyncio
+import random
+import logging
+from contextlib import nullcontext
+from flow_control import is_overload_error
+
+
+def is_retryable(exc):
+    """Transient failures worth another attempt: overload, timeouts and dropped connections"""
+    if is_overload_error(exc):
+        return True
+    if getattr(exc, 'should_retry', False):
+        return True
+    return isinstance(exc, (ConnectionError, OSError)) or type(exc).__name__ in ('ConnectionException',)
+
+
+# Bad or unauthorised key, exhausted quota: the whole account fails, whatever the request
+FATAL_STATUS_CODES = (401, 403, 456)
+FATAL_ERROR_NAMES = ('AuthorizationException', 'QuotaExceededException', 'AuthenticationError',
+                     'PermissionDeniedError')
+
+
+def is_fatal(exc):
+    """Account-wide failures that neither a retry nor a smaller request can fix"""
+    status = getattr(exc, 'status_code', None) or getattr(exc, 'http_status_code', None)
+    return status in FATAL_STATUS_CODES or type(exc).__name__ in FATAL_ERROR_NAMES
+
+
+async def _attempt(make_call, timeout, gate, started=None):
+    """One call, entering `gate` first so time spent queueing never counts against the timeout"""
+    async with gate() if gate is not None else nullcontext():
+        if started is not None:
+            started.set()
+        return await asyncio.wait_for(make_call(), timeout)
+
+
+async def _hedged(make_call, timeout, hedge_after, gate):
+    """
+    Run make_call, launching one duplicate if it hasn't finished hedge_after seconds after passing its
+    gate; first success wins. The duplicate goes through the gate too, so limiters account for it.
+    """
+    started = asyncio.Event()
+    primary = asyncio.ensure_future(_attempt(make_call, timeout, gate, started))
+    if hedge_after is None:
+        return await primary
+
+    pending = {primary}
+    try:
+        waiting = asyncio.ensure_future(started.wait())
+        try:
+            await asyncio.wait({primary, waiting}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiting.cancel()
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        pending.add(asyncio.ensure_future(_attempt(make_call, timeout, gate)))
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def call_with_retry(make_call, *, name="request", timeout=60.0, attempts=4, base_delay=0.5,
+                          max_delay=20.0, hedge_after=None, gate=None):
+    """
+    Await make_call() with a per-attempt timeout, retrying retryable errors with full-jitter
+    exponential backoff. If hedge_after is set, a duplicate request is raced against any attempt
+    that is still running after that many seconds.
+
+    `gate` is an async context manager factory (rate limit, concurrency slot) entered around every
+    call, the hedge included, but outside its timeout, so time spent queueing never counts as a slow
+    call, and the gate sees each call's outcome, including timeouts.
+    """
+    for attempt in range(attempts):
+        try:
+            return await _hedged(make_call, timeout, hedge_after, gate)
+        except Exception as e:
+            if attempt == attempts - 1 or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            logging.warning(f"{name} failed ({e!r}), retrying in {delay:.1f}s "
+                            f"(attempt {attempt + 2}/{attempts})")
+            await asyncio.sleep(delay)
@@ -0,0 +1,43 @@
+import json
+import os
+import threading
+import logging
+
+
+class SyncState:
+    """
+    Per-device export watermarks persisted as JSON.
+    A watermark is the (DateCreated, BookmarkID) of the newest highlight already exported from that device.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self._state = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.error(f"Could not read sync state {path}: {e}")
+
+    def get_watermark(self, device_id):
+        entry = self._state.get(device_id, {}).get('watermark')
+        return tuple(entry) if entry else None
+
+    def set_watermark(self, device_id, date_created, bookmark_id):
+        with self._lock:
+            current = self.get_watermark(device_id)
+            # Never move backwards, e.g. after re-exporting an older date range
+            if current is not None and tuple(current) >= (date_created, bookmark_id):
+                return
+            self._state.setdefault(device_id, {})['watermark'] = [date_created, bookmark_id]
+            self._save()
+        logging.info(f"Export watermark for {device_id} advanced to {date_created}")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The app is a flat set of modules run from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def kobo_sqlite(tmp_path):
+    """
+    A KoboReader.sqlite with the tables the app reads: two books, 20 highlights. There are only four
+    distinct DateCreated values, so ordering and cursors have to break ties on BookmarkID.
+    """
+    path = tmp_path / 'KoboReader.sqlite'
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE Content (ContentID TEXT PRIMARY KEY, ContentType TEXT, BookID TEXT, BookTitle TEXT,
+                              Title TEXT, Attribution TEXT, DateLastRead TEXT, ___SyncTime TEXT);
+        CREATE TABLE Bookmark (BookmarkID TEXT PRIMARY KEY, VolumeID TEXT, ContentID TEXT, Text TEXT,
+                               Annotation TEXT, DateCreated TEXT, DateModified TEXT, Type TEXT, Hidden TEXT);
+    """)
+    for book in range(2):
+        conn.execute("INSERT INTO Content VALUES (?, '6', NULL, NULL, ?, ?, '2024-01-01', NULL)",
+                     (f'book{book}', f'Title {book}', f'Author {book}'))
+        conn.execute("INSERT INTO Content VALUES (?, '899', ?, ?, 'Chapter', NULL, NULL, NULL)",
+                     (f'book{book}#ch1', f'book{book}', f'Title {book}'))
+    for i in range(20):
+        conn.execute("INSERT INTO Bookmark VALUES (?, ?, ?, ?, ?, ?, NULL, 'highlight', 'false')",
+                     (f'bm{i:02d}', f'book{i % 2}', f'book{i % 2}#ch1', f'palabra {i}',
+                      'note' if i % 3 == 0 else None, f'2024-02-0{1 + i % 4}T10:00:00.000'))
+    conn.commit()
+    conn.close()
+    return path
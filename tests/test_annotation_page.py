@@ -0,0 +1,63 @@
+import pytest
+
+from annotation_query import AnnotationFilter
+from kobo_db import KoboDatabase, KoboSource
+from kobo_snapshot import SnapshotStore
+from kobo_utils import KoboUtils
+
+
+class Library(KoboUtils):
+    def __init__(self, cache_dir):
+        self.kobo_db = KoboDatabase()
+        self.snapshots = SnapshotStore(str(cache_dir))
+
+
+@pytest.fixture
+def library(tmp_path):
+    return Library(tmp_path / 'snapshots')
+
+
+@pytest.fixture
+def source(kobo_sqlite):
+    return KoboSource(kobo_sqlite, 'kobo:test')
+
+
+def read_all_pages(library, source, annotation_filter, page_size):
+    pages = [library.fetch_annotation_page(annotation_filter, source, page_size=page_size)]
+    while pages[-1].next_filter is not None:
+        pages.append(library.fetch_annotation_page(pages[-1].next_filter, source, page_size=page_size,
+                                                   total=pages[0].total))
+    return pages
+
+
+@pytest.mark.parametrize('page_size', [1, 3, 4, 5, 7, 20, 50])
+def test_pages_cover_every_highlight_once_in_order(library, source, page_size):
+    everything = library.query_annotations(AnnotationFilter(), source)
+    pages = read_all_pages(library, source, AnnotationFilter(), page_size)
+
+    assert [annotation for page in pages for annotation in page.annotations] == everything
+    assert all(len(page.annotations) == page_size for page in pages[:-1])
+    assert 0 < len(pages[-1].annotations) <= page_size
+    assert pages[0].total == 20
+
+
+def test_page_boundary_inside_a_run_of_equal_dates(library, source):
+    # bm00, bm04, bm08, ... share one DateCreated; the cursor must resume mid-run
+    first = library.fetch_annotation_page(AnnotationFilter(), source, page_size=2)
+    assert [annotation.bookmark_id for annotation in first.annotations] == ['bm00', 'bm04']
+    second = library.fetch_annotation_page(first.next_filter, source, page_size=2, total=first.total)
+    assert [annotation.bookmark_id for annotation in second.annotations] == ['bm08', 'bm12']
+
+
+def test_pages_keep_the_other_filters(library, source):
+    annotation_filter = AnnotationFilter(title='Title 1', has_note=True)
+    pages = read_all_pages(library, source, annotation_filter, 2)
+    page_ids = [[annotation.bookmark_id for annotation in page.annotations] for page in pages]
+    assert page_ids == [['bm09', 'bm03'], ['bm15']]
+    assert pages[0].total == 3
+
+
+def test_exact_multiple_of_the_page_size_has_no_empty_last_page(library, source):
+    pages = read_all_pages(library, source, AnnotationFilter(author='Author 0'), 5)
+    assert [len(page.annotations) for page in pages] == [5, 5]
+    assert pages[-1].next_filter is None
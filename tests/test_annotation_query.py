@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+from annotation_query import AnnotationFilter, count_query, select_query
+
+
+@pytest.fixture
+def conn(kobo_sqlite):
+    conn = sqlite3.connect(kobo_sqlite)
+    yield conn
+    conn.close()
+
+
+def fetch(conn, annotation_filter):
+    sql, params = select_query(annotation_filter)
+    return conn.execute(sql, params).fetchall()
+
+
+def ids(rows):
+    return [row[5] for row in rows]
+
+
+def test_rows_are_ordered_by_date_then_bookmark_id(conn):
+    keys = [(row[2], row[5]) for row in fetch(conn, AnnotationFilter())]
+    assert len(keys) == 20
+    assert keys == sorted(keys)
+
+
+def test_filters_combine(conn):
+    assert ids(fetch(conn, AnnotationFilter(title='Title 1', has_note=True))) == ['bm09', 'bm03', 'bm15']
+    assert len(fetch(conn, AnnotationFilter(author='Author 0', has_note=False))) == 6
+    assert len(fetch(conn, AnnotationFilter(titles=('Title 0', 'Title 1')))) == 20
+
+
+def test_date_range_is_inclusive(conn):
+    rows = fetch(conn, AnnotationFilter(start_date='2024-02-02T10:00:00.000', end_date='2024-02-03T10:00:00.000'))
+    assert {row[2][:10] for row in rows} == {'2024-02-02', '2024-02-03'}
+    assert len(rows) == 10
+
+
+def test_after_cursor_breaks_ties_on_bookmark_id(conn):
+    after = ('2024-02-01T10:00:00.000', 'bm04')
+    assert ids(fetch(conn, AnnotationFilter(after=after, limit=3))) == ['bm08', 'bm12', 'bm16']
+
+
+def test_count_ignores_the_limit(conn):
+    sql, params = count_query(AnnotationFilter(author='Author 0', limit=2))
+    assert conn.execute(sql, params).fetchone()[0] == 10
+
+
+def test_like_wildcards_in_search_text_are_literal(conn):
+    conn.execute("UPDATE Bookmark SET Text = '100% sure' WHERE BookmarkID = 'bm00'")
+    assert ids(fetch(conn, AnnotationFilter(text_contains='0%'))) == ['bm00']
+
+
+def test_filters_with_the_same_shape_share_one_statement():
+    first, first_params = select_query(AnnotationFilter(author='Author 0', limit=5))
+    second, second_params = select_query(AnnotationFilter(author='Author 1', limit=50))
+    assert first is second
+    assert first_params != second_params
@@ -0,0 +1,38 @@
+import asyncio
+import json
+
+from translation_utils import DEEPL_MAX_BYTES, apack_batches, pack_batches
+
+
+def test_batches_hold_at_most_max_texts_in_order():
+    texts = [f'text {i}' for i in range(120)]
+    batches = list(pack_batches(texts))
+    assert [len(batch) for batch in batches] == [50, 50, 20]
+    assert [text for batch in batches for text in batch] == texts
+
+
+def test_non_latin_text_is_budgeted_at_its_escaped_size():
+    # 4,800 UTF-8 bytes of Japanese each, but over 9,600 bytes once JSON-escaped
+    texts = ['日本語のテキスト' * 100] * 100
+    batches = list(pack_batches(texts))
+    for batch in batches:
+        assert sum(len(json.dumps(text)) for text in batch) <= DEEPL_MAX_BYTES
+    assert max(len(batch) for batch in batches) == DEEPL_MAX_BYTES // len(json.dumps(texts[0]))
+
+
+def test_oversized_text_gets_a_batch_of_its_own():
+    texts = ['a', 'x' * 100, 'b']
+    assert list(pack_batches(texts, max_bytes=50)) == [['a'], ['x' * 100], ['b']]
+
+
+def test_async_batching_matches_sync():
+    texts = ['Привет, мир! ' * 30] * 300 + ['hello'] * 70
+
+    async def source():
+        for text in texts:
+            yield text
+
+    async def collect():
+        return [batch async for batch in apack_batches(source())]
+
+    assert asyncio.run(collect()) == list(pack_batches(texts))
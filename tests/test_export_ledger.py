@@ -0,0 +1,50 @@
+import pytest
+
+from export_ledger import ExportLedger, content_hash
+from kobo_db import Annotation
+
+
+def annotation(bookmark_id, text='palabra', note=None):
+    return Annotation(text, note, '2024-02-01T10:00:00.000', 'Author', 'Title', bookmark_id)
+
+
+def entry(device_id, item, guid):
+    return (device_id, item.bookmark_id, content_hash(item.text, item.annotation), guid)
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return ExportLedger(str(tmp_path / 'ledger' / 'export.sqlite'))
+
+
+def test_diff_of_empty_ledger_adds_everything(ledger):
+    changes = ledger.diff('reader', [annotation('a'), annotation('b')])
+    assert changes.added == {'a', 'b'}
+    assert changes.changed == set()
+    assert changes.deleted == []
+
+
+def test_diff_classifies_added_changed_deleted_and_unchanged(ledger):
+    kept, edited, removed = annotation('kept'), annotation('edited'), annotation('removed')
+    ledger.record([entry('reader', item, f'guid-{item.bookmark_id}') for item in (kept, edited, removed)])
+
+    changes = ledger.diff('reader', [kept, annotation('edited', note='new note'), annotation('new')])
+
+    assert changes.added == {'new'}
+    assert changes.changed == {'edited'}
+    assert changes.deleted == ['removed']
+    assert changes.pending == {'new', 'edited'}
+
+
+def test_diff_is_per_device(ledger):
+    ledger.record([entry('reader-1', annotation('a'), 'guid-a')])
+    changes = ledger.diff('reader-2', [annotation('a')])
+    assert changes.added == {'a'}
+    assert changes.deleted == []
+    assert ledger.diff('reader-1', []).deleted == ['a']
+
+
+def test_forget_makes_a_highlight_new_again(ledger):
+    ledger.record([entry('reader', annotation('a'), 'guid-a')])
+    ledger.forget([('reader', 'a')])
+    assert ledger.diff('reader', [annotation('a')]).added == {'a'}
@@ -0,0 +1,93 @@
+import genanki
+import pytest
+
+from export_ledger import ExportLedger, ledger_entries
+from kobo_db import Annotation, DeviceAnnotation
+from kobo_utils import merge_device_annotations
+
+
+def row(device_id, bookmark_id, text, date='2024-02-01T10:00:00.000', title='Title'):
+    return DeviceAnnotation(device_id, Annotation(text, None, date, 'Author', title, bookmark_id))
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return ExportLedger(str(tmp_path / 'export.sqlite'))
+
+
+def export(ledger, merged):
+    """What a run records for these rows, through the same calls as process_row and post_processing"""
+    ledger.record([entry for row in merged for entry in ledger_entries(row, ledger.note_guid(row))])
+
+
+def test_merge_keeps_date_order_across_devices():
+    first = [row('r1', 'a', 'uno', '2024-02-01'), row('r1', 'c', 'tres', '2024-02-03')]
+    second = [row('r2', 'b', 'dos', '2024-02-02')]
+    merged = merge_device_annotations([first, second])
+    assert [item.annotation.text for item in merged] == ['uno', 'dos', 'tres']
+
+
+def test_identical_highlights_on_one_reader_stay_separate():
+    rows = [row('r1', f'bm{i}', 'palabra') for i in range(5)]
+    merged = merge_device_annotations([rows])
+    assert len(merged) == 5
+    assert all(item.duplicates == () for item in merged)
+
+
+def test_same_highlight_on_two_readers_is_merged():
+    merged = merge_device_annotations([[row('r1', 'a', 'palabra  nueva ')], [row('r2', 'x', 'palabra nueva')]])
+    assert len(merged) == 1
+    assert merged[0].device_id == 'r1'
+    assert [(device_id, item.bookmark_id) for device_id, item in merged[0].duplicates] == [('r2', 'x')]
+
+
+def test_same_text_in_different_books_is_not_merged():
+    merged = merge_device_annotations([[row('r1', 'a', 'palabra', title='One')], [row('r2', 'x', 'palabra', title='Two')]])
+    assert len(merged) == 2
+
+
+def test_duplicates_pair_up_one_per_reader():
+    merged = merge_device_annotations([
+        [row('r1', 'a', 'palabra'), row('r1', 'b', 'palabra')],
+        [row('r2', 'x', 'palabra'), row('r2', 'y', 'palabra')],
+    ])
+    assert len(merged) == 2
+    assert all(len(item.duplicates) == 1 for item in merged)
+
+
+def test_merged_copies_share_one_guid_across_runs(ledger):
+    export(ledger, merge_device_annotations([[row('r1', 'a', 'palabra')]]))
+    export(ledger, merge_device_annotations([[row('r2', 'x', 'palabra')], [row('r1', 'a', 'palabra')]]))
+    assert ledger.guid_for([('r2', 'x')]) == ledger.guid_for([('r1', 'a')]) == genanki.guid_for('r1', 'a')
+
+
+def test_note_survives_until_every_copy_is_deleted(ledger):
+    export(ledger, merge_device_annotations([[row('r1', 'a', 'palabra')], [row('r2', 'x', 'palabra')]]))
+
+    # Deleted on one reader only: the other copy still stands for the note
+    deleted = [('r1', 'a')]
+    assert ledger.orphaned(deleted) == []
+    ledger.forget(deleted)
+    assert ledger.guid_for([('r2', 'x')]) == genanki.guid_for('r1', 'a')
+
+    # The last copy goes: now the note can be deleted
+    assert ledger.orphaned([('r2', 'x')]) == [('r2', 'x')]
+
+
+def test_deleting_every_copy_at_once_orphans_all_of_them(ledger):
+    export(ledger, merge_device_annotations([[row('r1', 'a', 'palabra')], [row('r2', 'x', 'palabra')]]))
+    deleted = [('r1', 'a'), ('r2', 'x')]
+    assert sorted(ledger.orphaned(deleted)) == deleted
+
+
+def test_edited_highlight_keeps_its_note(ledger):
+    export(ledger, merge_device_annotations([[row('r1', 'a', 'palabra')]]))
+    edited = merge_device_annotations([[row('r1', 'a', 'palabra editada')]])
+    assert ledger.diff('r1', [edited[0].annotation]).changed == {'a'}
+    assert ledger.note_guid(edited[0]) == genanki.guid_for('r1', 'a')
+
+
+def test_unmerged_duplicates_on_one_reader_are_deleted_independently(ledger):
+    export(ledger, merge_device_annotations([[row('r1', 'a', 'palabra'), row('r1', 'b', 'palabra')]]))
+    assert ledger.guid_for([('r1', 'a')]) != ledger.guid_for([('r1', 'b')])
+    assert ledger.orphaned([('r1', 'a')]) == [('r1', 'a')]
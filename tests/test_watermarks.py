@@ -0,0 +1,90 @@
+from kobo_db import Annotation, DeviceAnnotation
+from kobo_utils import export_watermarks, watermark_key
+from sync_state import SyncState
+
+
+def highlight(bookmark_id, date):
+    return Annotation('palabra', None, date, 'Author', 'Title', bookmark_id)
+
+
+def row(device_id, bookmark_id, date, duplicates=()):
+    return DeviceAnnotation(device_id, highlight(bookmark_id, date), tuple(duplicates))
+
+
+def test_every_row_noted_advances_to_the_newest_per_device():
+    outcomes = {
+        1: (row('r1', 'a', '2024-02-01'), True),
+        2: (row('r2', 'x', '2024-02-02'), True),
+        3: (row('r1', 'b', '2024-02-03'), True),
+    }
+    assert export_watermarks(outcomes) == {'r1': ('2024-02-03', 'b'), 'r2': ('2024-02-02', 'x')}
+
+
+def test_failed_row_blocks_only_its_own_device():
+    outcomes = {
+        1: (row('r1', 'a', '2024-02-01'), True),
+        2: (row('r1', 'b', '2024-02-02'), False),
+        3: (row('r2', 'x', '2024-02-03'), True),
+        4: (row('r1', 'c', '2024-02-04'), True),
+        5: (row('r2', 'y', '2024-02-05'), True),
+    }
+    assert export_watermarks(outcomes) == {'r1': ('2024-02-01', 'a'), 'r2': ('2024-02-05', 'y')}
+
+
+def test_failed_first_row_leaves_its_device_without_a_watermark():
+    outcomes = {1: (row('r1', 'a', '2024-02-01'), False), 2: (row('r1', 'b', '2024-02-02'), True)}
+    assert export_watermarks(outcomes) == {}
+
+
+def test_gap_in_indices_stops_every_device():
+    outcomes = {
+        1: (row('r1', 'a', '2024-02-01'), True),
+        2: (row('r2', 'x', '2024-02-02'), True),
+        # 3 never finished, e.g. the run was aborted while it was being processed
+        4: (row('r1', 'b', '2024-02-04'), True),
+        5: (row('r2', 'y', '2024-02-05'), True),
+    }
+    assert export_watermarks(outcomes) == {'r1': ('2024-02-01', 'a'), 'r2': ('2024-02-02', 'x')}
+
+
+def test_nothing_processed_means_no_watermarks():
+    assert export_watermarks({}) == {}
+    assert export_watermarks({2: (row('r1', 'a', '2024-02-01'), True)}) == {}
+
+
+def test_merged_duplicates_advance_the_other_readers():
+    merged = row('r1', 'a', '2024-02-01', duplicates=[('r2', highlight('x', '2024-02-01T09:00'))])
+    outcomes = {1: (merged, True), 2: (row('r1', 'b', '2024-02-02'), True)}
+    assert export_watermarks(outcomes) == {'r1': ('2024-02-02', 'b'), 'r2': ('2024-02-01T09:00', 'x')}
+
+
+def test_failed_merged_row_blocks_every_reader_it_came_from():
+    merged = row('r1', 'a', '2024-02-01', duplicates=[('r2', highlight('x', '2024-02-01'))])
+    outcomes = {
+        1: (merged, False),
+        2: (row('r1', 'b', '2024-02-02'), True),
+        3: (row('r2', 'y', '2024-02-03'), True),
+        4: (row('r3', 'm', '2024-02-04'), True),
+    }
+    assert export_watermarks(outcomes) == {'r3': ('2024-02-04', 'm')}
+
+
+def test_watermark_never_moves_backwards(tmp_path):
+    path = tmp_path / 'sync_state.json'
+    state = SyncState(str(path))
+    state.set_watermark('r1', '2024-02-03', 'b')
+
+    state.set_watermark('r1', '2024-02-01', 'z')
+    state.set_watermark('r1', '2024-02-03', 'a')
+    assert state.get_watermark('r1') == ('2024-02-03', 'b')
+
+    state.set_watermark('r1', '2024-02-03', 'c')
+    assert state.get_watermark('r1') == ('2024-02-03', 'c')
+    assert SyncState(str(path)).get_watermark('r1') == ('2024-02-03', 'c')
+
+
+def test_filtered_exports_keep_their_own_watermark(tmp_path):
+    state = SyncState(str(tmp_path / 'sync_state.json'))
+    state.set_watermark(watermark_key('r1', title='Title'), '2024-02-05', 'a')
+    assert state.get_watermark(watermark_key('r1')) is None
+    assert state.get_watermark(watermark_key('r1', title='Title')) == ('2024-02-05', 'a')
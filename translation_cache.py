@@ -0,0 +1,122 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import logging
+
+
+def normalize_text(text):
+    """Normalise source text so trivially different highlights share a cache entry"""
+    text = unicodedata.normalize('NFC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class TranslationCache:
+    """
+    SQLite-backed translation cache keyed on (backend, source lang, target lang, normalised text).
+    Entries are evicted least-recently-used first once max_entries is exceeded.
+    """
+
+    def __init__(self, db_path, max_entries=100_000, enabled=True):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                backend TEXT NOT NULL,
+                source_lang TEXT NOT NULL,
+                target_lang TEXT NOT NULL,
+                source_text TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (backend, source_lang, target_lang, source_text)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    @staticmethod
+    def _key(text, target_lang, source_lang, backend):
+        return backend, source_lang or 'auto', target_lang, normalize_text(text)
+
+    def get(self, text, target_lang, source_lang=None, backend='deepl'):
+        if not self.enabled:
+            return None
+        key = self._key(text, target_lang, source_lang, backend)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT translation FROM translations "
+                "WHERE backend = ? AND source_lang = ? AND target_lang = ? AND source_text = ?",
+                key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE translations SET last_used = ? "
+                "WHERE backend = ? AND source_lang = ? AND target_lang = ? AND source_text = ?",
+                (time.time(), *key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, text, translation, target_lang, source_lang=None, backend='deepl'):
+        if not self.enabled:
+            return
+        key = self._key(text, target_lang, source_lang, backend)
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE translations SET translation = ?, last_used = ? "
+                "WHERE backend = ? AND source_lang = ? AND target_lang = ? AND source_text = ?",
+                (translation, time.time(), *key)
+            )
+            if cursor.rowcount == 0:
+                self._conn.execute(
+                    "INSERT INTO translations "
+                    "(backend, source_lang, target_lang, source_text, translation, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (*key, translation, time.time())
+                )
+                self._size += 1
+            if self._size > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        excess = self._size - self.max_entries
+        self._conn.execute(
+            "DELETE FROM translations WHERE rowid IN "
+            "(SELECT rowid FROM translations ORDER BY last_used ASC LIMIT ?)",
+            (excess,)
+        )
+        self._size = self.max_entries
+        logging.info(f"Evicted {excess} translations from cache")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': self._size,
+        }
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from translation_cache import TranslationCache
+from flow_control import rate_limiter
+from resilience import call_with_retry, is_fatal, is_retryable
+
+
+TARGET_LANG = "EN-US"
+
+# DeepL accepts at most 50 texts and a 128 KiB request body per translate call
+DEEPL_MAX_TEXTS = 50
+DEEPL_MAX_BYTES = 120 * 1024
+
+
+class _BatchPacker:
+    """
+    The one batching loop behind pack_batches and apack_batches: texts go into the current batch until
+    the next one would break the per-request text count or size limit. Sizes are measured as the client
+    sends them, JSON with ASCII escapes, where non-Latin text takes two to three times its UTF-8 size.
+    """
+
+    def __init__(self, max_texts, max_bytes):
+        self.max_texts = max_texts
+        self.max_bytes = max_bytes
+        self.batch = []
+        self.batch_bytes = 0
+
+    def add(self, text):
+        """Add a text; returns the batch it closed off, or None"""
+        size = len(json.dumps(text))
+        full = None
+        if self.batch and (len(self.batch) >= self.max_texts or self.batch_bytes + size > self.max_bytes):
+            full, self.batch, self.batch_bytes = self.batch, [], 0
+        self.batch.append(text)
+        self.batch_bytes += size
+        return full
+
+
+def pack_batches(texts, max_texts=DEEPL_MAX_TEXTS, max_bytes=DEEPL_MAX_BYTES):
+    """Split texts into consecutive batches that respect the per-request text count and size limits"""
+    packer = _BatchPacker(max_texts, max_bytes)
+    for text in texts:
+        batch = packer.add(text)
+        if batch:
+            yield batch
+    if packer.batch:
+        yield packer.batch
+
+
+async def apack_batches(texts, max_texts=DEEPL_MAX_TEXTS, max_bytes=DEEPL_MAX_BYTES):
+    """pack_batches for an async iterable of texts"""
+    packer = _BatchPacker(max_texts, max_bytes)
+    async for text in texts:
+        batch = packer.add(text)
+        if batch:
+            yield batch
+    if packer.batch:
+        yield packer.batch
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+class TranslationUtils:
+
+    def get_cache_dir(self):
+        cache_dir = os.path.join(self.get_user_data_dir(), "cache")
+        os.makedirs(cache_dir, exist_ok=True)
+        return cache_dir
+
+    def create_translation_cache(self):
+        return TranslationCache(os.path.join(self.get_cache_dir(), "translations.sqlite"))
+
+    def lookup_cached(self, texts, target_lang=TARGET_LANG):
+        """Split unique texts into ({text: cached translation}, [texts that still need translating])"""
+        results = {}
+        pending = []
+        for text in dict.fromkeys(texts):
+            cached = self.translation_cache.get(text, target_lang)
+            if cached is not None:
+                results[text] = cached
+            else:
+                pending.append(text)
+        return results, pending
+
+    def deepl_translate(self, batch, target_lang=TARGET_LANG):
+        rate_limiter('deepl').acquire(chars=sum(len(text) for text in batch))
+        translations = [result.text for result in self.translator.translate_text(batch, target_lang=target_lang)]
+        for text, translation in zip(batch, translations):
+            self.translation_cache.put(text, translation, target_lang)
+        return translations
+
+    async def atranslate_batch(self, texts, target_lang=TARGET_LANG):
+        """
+        Translate a list of texts with as few DeepL requests as possible.
+        Returns one entry per input, in order: the translation, or the exception that item failed with.
+        """
+        results, pending = await asyncio.to_thread(self.lookup_cached, texts, target_lang)
+        for batch in pack_batches(pending):
+            await self._atranslate_request(batch, target_lang, results)
+        return [results[text] for text in texts]
+
+    async def _atranslate_request(self, batch, target_lang, results):
+        try:
+            # No timeout here: wait_for can't stop a blocking call on a thread, so the DeepL client's
+            # own request timeout (set from translation_timeout) bounds each attempt instead
+            translations = await call_with_retry(
+                lambda: asyncio.to_thread(self.deepl_translate, batch, target_lang),
+                name="DeepL translation",
+                timeout=None,
+                hedge_after=self.translation_hedge_after
+            )
+        except Exception as e:
+            if len(batch) == 1 or is_retryable(e) or is_fatal(e):
+                # Retries are exhausted or the account itself is failing, so the whole batch shares the failure
+                logging.error(f"Error translating {len(batch)} text(s) starting '{batch[0]}': {e}")
+                results.update((text, e) for text in batch)
+                return
+            # Bisect so one bad item only costs log2(n) extra requests rather than one per row
+            middle = len(batch) // 2
+            await self._atranslate_request(batch[:middle], target_lang, results)
+            await self._atranslate_request(batch[middle:], target_lang, results)
+            return
+
+        results.update(zip(batch, translations))
+
+    async def atranslate_texts(self, texts, target_lang=TARGET_LANG, concurrency=None):
+        """
+        Yield (text, translation or exception) in input order. `texts` may be a list or an async generator,
+        which is consumed only as fast as translation proceeds and closed along with this one. Batches are translated with up to
+        `concurrency` requests in flight, with the blocking DeepL client kept on worker threads.
+        """
+        concurrency = concurrency or self.translation_concurrency
+        if not hasattr(texts, '__aiter__'):
+            texts = _aiter(texts)
+        windows = apack_batches(texts)
+        in_flight = deque()
+
+        async def submit_next():
+            window = await anext(windows, None)
+            if window is not None:
+                task = asyncio.ensure_future(self.atranslate_batch(window, target_lang))
+                in_flight.append((window, task))
+
+        for _ in range(concurrency):
+            await submit_next()
+
+        try:
+            while in_flight:
+                window, task = in_flight.popleft()
+                results = await task
+                await submit_next()
+                for item in zip(window, results):
+                    yield item
+        finally:
+            for _, task in in_flight:
+                task.cancel()
+            await windows.aclose()
+            await texts.aclose()
+
+    def log_translation_cache_stats(self):
+        stats = self.translation_cache.stats()
+        logging.info(
+            f"Translation cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries"
+        )
@@ -7,6 +7,23 @@ import os
 from queue import Empty
 import json
 import sys
+import time
+from kobo_utils import KoboNotFoundError, EXPORT_ALL, EXPORT_NEW, EXPORT_CHANGED, PREVIEW_CHANNEL
+from annotation_query import AnnotationFilter
+from virtual_listbox import VirtualListbox
+from background_query import BackgroundQueries
+from progress_events import TotalKnown, Translated, CardDone, PhaseComplete, RunDone
+
+
+# Quiet period after the last keystroke before a live annotation search runs
+SEARCH_DEBOUNCE_MS = 300
+# Progress events taken from the UI subscription at a time
+UI_DRAIN_CHUNK = 64
+# Queue draining per update_ui call is capped so input and redraws stay responsive during a fast run
+UI_FRAME_BUDGET = 0.008
+UI_POLL_MS = 33
+# Progress bar and label are redrawn at most this often
+PROGRESS_FRAME_INTERVAL = 1 / 30
 
 
 def get_api_keys_path():
@@ -19,6 +36,7 @@ def get_api_keys_path():
 class UI:
     def setup_ui(self):
         self.root.title("Kobo Book and Author Fetcher")
+        self.background = BackgroundQueries(self.root)
 
         main_frame = ttk.Frame(self.root)
         main_frame.pack(fill=tk.BOTH, expand=True)
@@ -51,6 +69,11 @@ class UI:
                                             command=self.toggle_openai_entry)
         self.tts_checkbox.pack(side=tk.LEFT, padx=5)
 
+        self.use_translation_cache = tk.BooleanVar(value=True)
+        self.cache_checkbox = ttk.Checkbutton(api_frame, text="Use Translation Cache",
+                                              variable=self.use_translation_cache)
+        self.cache_checkbox.pack(side=tk.LEFT, padx=5)
+
         self.save_keys_button = ttk.Button(api_frame, text="Save API Keys", command=self.save_api_keys)
         self.save_keys_button.pack(side=tk.LEFT, padx=5)
 
@@ -61,6 +84,7 @@ class UI:
         self.sort_option = tk.StringVar(value='Author')
         sort_menu = ttk.OptionMenu(sort_frame, self.sort_option, 'Author', 'Author', 'Book', 'Date Added')
         sort_menu.pack(side=tk.LEFT, padx=5)
+        self.sort_option.trace_add('write', lambda *_: self.fetch_books_and_authors_with_sort())
 
         fetch_button = ttk.Button(sort_frame, text="Fetch Books & Authors",
                                   command=self.fetch_books_and_authors_with_sort)
@@ -84,6 +108,8 @@ class UI:
         ttk.Label(self.kobo_frame, text="Book Title:").pack(pady=5)
         self.title_entry = ttk.Entry(self.kobo_frame)
         self.title_entry.pack(fill=tk.X, padx=5, pady=5)
+        for entry in (self.author_entry, self.title_entry):
+            entry.bind('<KeyRelease>', lambda event: self.fetch_and_display_annotations(live=True))
 
         ttk.Label(self.kobo_frame, text="Start Date:").pack(pady=5)
         self.start_date_picker = DateEntry(self.kobo_frame, width=12, background='darkblue', foreground='white',
@@ -95,12 +121,27 @@ class UI:
                                          borderwidth=2, date_pattern='yyyy-mm-dd')
         self.end_date_picker.pack(fill=tk.X, padx=5, pady=5)
 
+        ttk.Label(self.kobo_frame, text="Export:").pack(pady=5)
+        self.export_mode = tk.StringVar(value=EXPORT_ALL)
+        self.export_mode_menu = ttk.Combobox(self.kobo_frame, textvariable=self.export_mode, state="readonly",
+                                             values=[EXPORT_ALL, EXPORT_NEW, EXPORT_CHANGED])
+        self.export_mode_menu.pack(fill=tk.X, padx=5, pady=5)
+
         self.search_button = ttk.Button(self.kobo_frame, text="Search Annotations",
                                         command=self.fetch_and_display_annotations)
         self.search_button.pack(fill=tk.X, padx=5, pady=5)
 
 
 
+        ttk.Label(self.kobo_frame, text="Search Text:").pack(pady=5)
+        self.search_text_entry = ttk.Entry(self.kobo_frame)
+        self.search_text_entry.pack(fill=tk.X, padx=5, pady=5)
+        self.search_text_entry.bind('<Return>', lambda event: self.search_and_display_highlights())
+
+        self.search_text_button = ttk.Button(self.kobo_frame, text="Search Highlight Text",
+                                             command=self.search_and_display_highlights)
+        self.search_text_button.pack(fill=tk.X, padx=5, pady=5)
+
         # 3. Text file import frame
         self.import_frame = ttk.LabelFrame(sidebar_frame, text="Text File Import")
         self.import_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -142,9 +183,21 @@ class UI:
         self.open_dir_button.pack(fill=tk.X, pady=5)
 
         # Listbox in the main content area
-        self.listbox = tk.Listbox(content_frame, width=100, height=20, font=("Courier", 16))
+        self.listbox = VirtualListbox(content_frame, width=100, height=20, font=("Courier", 16))
         self.listbox.pack(fill=tk.BOTH, expand=True, pady=10)
 
+        preview_frame = ttk.Frame(content_frame)
+        preview_frame.pack(fill=tk.X)
+
+        self.preview_label = ttk.Label(preview_frame, text="")
+        self.preview_label.pack(side=tk.LEFT, padx=5)
+
+        self.load_more_button = ttk.Button(preview_frame, text="Load More", command=self.load_more_annotations,
+                                           state=tk.DISABLED)
+        self.load_more_button.pack(side=tk.RIGHT, padx=5)
+        self.preview_page = None
+        self.showing_catalog = False
+
         self.progress_bar = ttk.Progressbar(content_frame, orient="horizontal", length=300, mode="determinate")
         self.progress_bar.pack(pady=10)
 
@@ -156,6 +209,9 @@ class UI:
         # Set up the initial state
         self.toggle_source()
 
+        # Last known library, shown at once and refreshed when a reader is detected
+        self.show_saved_catalog()
+
 
 
     def toggle_source(self):
@@ -163,7 +219,9 @@ class UI:
         if self.source_var.get() == "kobo":
             # Enable Kobo-related fields
             for child in self.kobo_frame.winfo_children():
-                if isinstance(child, (ttk.Entry, DateEntry, ttk.Button)):
+                if isinstance(child, ttk.Combobox):
+                    child.config(state="readonly")
+                elif isinstance(child, (ttk.Entry, DateEntry, ttk.Button)):
                     child.config(state="normal")
             self.kobo_frame.config(style='')
             self.import_frame.config(style='Dim.TLabelframe')
@@ -197,44 +255,95 @@ class UI:
             self.openai_key_entry.config(state="normal")
         else:
             self.openai_key_entry.config(state="disabled")
+    def reset_preview(self):
+        """Forget the paginated preview whenever the listbox is reused for something else"""
+        self.preview_page = None
+        self.showing_catalog = False
+        self.load_more_button.config(state=tk.DISABLED)
+        self.preview_label.config(text="")
+
     def display_annotations(self, annotations):
-        self.listbox.delete(0, tk.END)
+        self.reset_preview()
 
         if not annotations:
-            self.listbox.insert(tk.END, "No annotations found.")
+            self.listbox.set_rows(["No annotations found."])
             return
 
-        headers = ["Text", "Date Created"]
-        self.listbox.insert(tk.END, f"{'Text':<80} | {'Date Created':<20}")
-        self.listbox.insert(tk.END, "-" * 102)
-
-        for annotation in annotations:
-            text = annotation[0]
-            date_created = annotation[2]
+        header = [f"{'Text':<80} | {'Date Created':<20}", "-" * 102]
+        self.listbox.set_rows(header + list(annotations), formatter=self.format_annotation_line)
+        self.listbox.config(width=102)
 
-            if len(text) > 77:
-                formatted_text = text[:77] + "..."
-            else:
-                formatted_text = text.ljust(80)
+    def format_annotation_line(self, annotation):
+        text = annotation[0]
+        date_created = annotation[2]
 
-            formatted_date = date_created[:19]
+        if len(text) > 77:
+            formatted_text = text[:77] + "..."
+        else:
+            formatted_text = text.ljust(80)
 
-            formatted_line = f"{formatted_text} | {formatted_date:<20}"
-            self.listbox.insert(tk.END, formatted_line)
+        formatted_date = date_created[:19]
 
-        self.listbox.config(width=102)
+        return f"{formatted_text} | {formatted_date:<20}"
 
-
-    def fetch_and_display_annotations(self):
+    def display_annotation_page(self, page, first=False):
+        if first:
+            self.display_annotations(page.annotations)
+        else:
+            self.listbox.extend(page.annotations)
+        self.preview_page = page
+        shown = self.listbox.size() - 2 if page.total else 0
+        self.preview_label.config(text=f"Showing {shown} of {page.total} annotations")
+        self.load_more_button.config(state=tk.NORMAL if page.next_filter else tk.DISABLED)
+
+    def fetch_and_display_annotations(self, live=False):
+        """Query on a worker thread; while typing (`live`), debounce and report errors in the status line"""
         author = self.author_entry.get()
         title = self.title_entry.get()
         start_date = self.start_date_picker.get_date().strftime("%Y-%m-%d") if self.start_date_picker.get() else None
         end_date = self.end_date_picker.get_date().strftime("%Y-%m-%d") if self.end_date_picker.get() else None
 
-        annotations = self.fetch_annotations(author, title, start_date, end_date)
-        self.display_annotations(annotations)
+        annotation_filter = AnnotationFilter(author=author or None, title=title or None,
+                                             start_date=start_date, end_date=end_date)
+        self.background.submit(
+            PREVIEW_CHANNEL,
+            lambda: self.fetch_annotation_page(annotation_filter),
+            lambda page: self.display_annotation_page(page, first=True),
+            on_error=self.show_preview_error if live else self.show_query_error,
+            delay_ms=SEARCH_DEBOUNCE_MS if live else 0
+        )
+
+    def load_more_annotations(self):
+        page = self.preview_page
+        if page is None or page.next_filter is None:
+            return
+        self.load_more_button.config(state=tk.DISABLED)
+        self.background.submit(
+            PREVIEW_CHANNEL,
+            lambda: self.fetch_annotation_page(page.next_filter, total=page.total),
+            self.display_annotation_page,
+            on_error=self.show_load_more_error
+        )
 
+    def search_and_display_highlights(self):
+        query = self.search_text_entry.get().strip()
+        if not query:
+            return
+        self.background.submit(PREVIEW_CHANNEL, lambda: self.search_highlights(query), self.display_annotations,
+                               on_error=self.show_query_error)
 
+    def show_query_error(self, error):
+        if isinstance(error, KoboNotFoundError):
+            messagebox.showerror("Error", str(error))
+        else:
+            messagebox.showerror("Error", f"An error occurred: {error}")
+
+    def show_load_more_error(self, error):
+        self.load_more_button.config(state=tk.NORMAL)
+        self.show_query_error(error)
+
+    def show_preview_error(self, error):
+        self.preview_label.config(text=str(error))
 
     def on_listbox_select(self, event):
         selection = self.listbox.curselection()
@@ -271,60 +380,29 @@ class UI:
                 self.root.after(100, self.check_error_queue)
 
     def update_ui(self):
-        try:
-            while True:
-                item = self.task_queue.get_nowait()
-
-                if item[0] == "TOTAL":
-                    _, self.total_cards, _, _ = item
-                    self.progress_bar["maximum"] = self.total_cards
-                    self.progress_label.config(text=f"{self.current_phase} Progress: 0/{self.total_cards}")
-                elif item[0] == "PHASE_COMPLETE":
-                    _, phase, _, _ = item
-                    self.listbox.delete(0, tk.END)
-                    self.current_progress = 0
-                    self.processed_cards.clear()
-
-                    # Update phase label based on TTS setting
-                    if phase == "Translation":
-                        self.current_phase = "Text-to-Speech" if self.use_tts.get() else "Processing Cards"
-                    else:
-                        self.current_phase = "Complete"
-
-                    self.progress_label.config(text=f"{self.current_phase} Progress: 0/{self.total_cards}")
-
-                # Rest of existing update_ui code...
-                elif item[0] == "DONE":
-                    _, _, self.total_cards, _ = item
-                    self.progress_bar["value"] = self.total_cards
-                    self.progress_label.config(text=f"Progress: {self.total_cards}/{self.total_cards}")
-                    self.processed_cards.clear()
-                elif item[0] in ["TRANSLATE", "TTS", "Processing"]:
-                    _, lang, eng, index, self.total_cards = item
-                    self.processed_cards[index] = (lang, eng)
-
-                    while self.current_progress + 1 in self.processed_cards:
-                        self.current_progress += 1
-                        lang, eng = self.processed_cards[self.current_progress]
-
-                        self.listbox.insert(tk.END,
-                                            f"{self.current_phase}: {lang[:50]}..." if len(
-                                                lang) > 50 else f"{self.current_phase}: {lang}")
-                        self.listbox.insert(tk.END,
-                                            f"Translation: {eng[:50]}..." if len(eng) > 50 else f"Translation: {eng}")
-                        self.listbox.insert(tk.END, "")
-                        self.listbox.yview_moveto(1)
-
-                        self.progress_bar["value"] = self.current_progress
-                        self.progress_label.config(
-                            text=f"{self.current_phase} Progress: {self.current_progress}/{self.total_cards}")
-
-                    for i in range(1, self.current_progress + 1):
-                        self.processed_cards.pop(i, None)
-
-                self.root.update_idletasks()
-        except Empty:
-            pass
+        """
+        Drain the UI's progress subscription for at most UI_FRAME_BUDGET, append the resulting listbox lines
+        in one batch and redraw the progress bar at a capped rate. Leftover events are picked up on
+        the next call, which is scheduled immediately when the queue could not be emptied, even once
+        the run has ended.
+        """
+        deadline = time.monotonic() + UI_FRAME_BUDGET
+        lines = []
+        backlog = False
+        while True:
+            if time.monotonic() >= deadline:
+                backlog = True
+                break
+            events = self.ui_events.drain(UI_DRAIN_CHUNK)
+            for event in events:
+                self.handle_progress_event(event, lines)
+            if len(events) < UI_DRAIN_CHUNK:
+                break
+
+        if lines:
+            self.listbox.extend(lines)
+            self.listbox.yview_moveto(1)
+        self.render_progress(force=not backlog)
 
         try:
             error_message = self.error_queue.get_nowait()
@@ -335,14 +413,64 @@ class UI:
         except Empty:
             pass
 
-        if self.is_running:
-            self.root.after(100, self.update_ui)
+        if backlog:
+            # Keep draining after the run ends too, or the last events (RunDone among them) are never shown
+            self.root.after(1, self.update_ui)
+        elif self.is_running:
+            self.root.after(UI_POLL_MS, self.update_ui)
         else:
             current_text = self.progress_label.cget("text")
             if "Progress:" in current_text and not current_text.startswith("Deck creation completed"):
                 self.progress_label.config(text="Deck creation completed. Check for import status.")
 
 
+    def handle_progress_event(self, event, lines):
+        if isinstance(event, TotalKnown):
+            self.total_cards = event.total
+            self.progress_bar["maximum"] = self.total_cards
+            self.progress_dirty = True
+        elif isinstance(event, PhaseComplete):
+            if event.phase == "Translation":
+                self.translated_count = self.total_cards
+            self.progress_dirty = True
+        elif isinstance(event, Translated):
+            # Translation runs ahead of card creation, so it only advances the label
+            self.total_cards = event.total
+            self.translated_count = max(self.translated_count, event.index)
+            self.progress_dirty = True
+        elif isinstance(event, RunDone):
+            self.total_cards = event.total
+            self.progress_bar["value"] = self.total_cards
+            self.progress_label.config(text=f"Progress: {self.total_cards}/{self.total_cards}")
+            self.processed_cards.clear()
+            self.progress_dirty = False
+        elif isinstance(event, CardDone):
+            self.total_cards = event.total
+            # Reorder buffer: cards finish out of order but are listed in order, each popped once
+            self.processed_cards[event.index] = (event.original, event.translation)
+            while self.current_progress + 1 in self.processed_cards:
+                self.current_progress += 1
+                lang, eng = self.processed_cards.pop(self.current_progress)
+                lines.append(f"{event.phase}: {lang[:50]}..." if len(lang) > 50 else f"{event.phase}: {lang}")
+                lines.append(f"Translation: {eng[:50]}..." if len(eng) > 50 else f"Translation: {eng}")
+                lines.append("")
+                self.progress_dirty = True
+
+    def render_progress(self, force=False):
+        now = time.monotonic()
+        if not self.progress_dirty or (not force and now - self.last_progress_render < PROGRESS_FRAME_INTERVAL):
+            return
+        self.progress_bar["value"] = self.current_progress
+        self.update_progress_label()
+        self.progress_dirty = False
+        self.last_progress_render = now
+
+    def update_progress_label(self):
+        text = f"{self.current_phase} Progress: {self.current_progress}/{self.total_cards}"
+        if self.translated_count < self.total_cards:
+            text += f" (Translated: {self.translated_count}/{self.total_cards})"
+        self.progress_label.config(text=text)
+
     def save_api_keys(self):
         api_keys = {
             'openai_key': self.openai_key_entry.get().strip(),
@@ -0,0 +1,186 @@
+import tkinter as tk
+from tkinter import ttk
+import tkinter.font as tkfont
+
+
+class VirtualListbox(ttk.Frame):
+    """
+    Listbox over an in-memory list of rows that only ever holds the rows currently on screen.
+    Rows are either plain strings or arbitrary objects turned into text by `formatter` when they
+    scroll into view, so loading, scrolling and refreshing cost the same for ten rows or a million.
+
+    It accepts the subset of the tk.Listbox API the app uses (insert, delete, get, size, curselection,
+    yview_moveto, config, bind), with indices referring to rows of the model rather than the screen.
+    """
+
+    def __init__(self, master, formatter=None, **listbox_options):
+        super().__init__(master)
+        self._rows = []
+        self._formatter = formatter
+        self._top = 0
+        self._visible = listbox_options.get('height', 20)
+        self._selected = None
+        self._render_pending = False
+
+        self._listbox = tk.Listbox(self, exportselection=False, **listbox_options)
+        self._scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self._scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self._listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self._update_line_height()
+
+        self._listbox.bind('<Configure>', self._on_configure)
+        self._listbox.bind('<<ListboxSelect>>', self._on_select)
+        self._listbox.bind('<MouseWheel>', self._on_mousewheel)
+        self._listbox.bind('<Button-4>', lambda event: self._scroll_by(-3))
+        self._listbox.bind('<Button-5>', lambda event: self._scroll_by(3))
+        self._listbox.bind('<Up>', lambda event: self._move_selection(-1))
+        self._listbox.bind('<Down>', lambda event: self._move_selection(1))
+        self._listbox.bind('<Prior>', lambda event: self._move_selection(-self._visible))
+        self._listbox.bind('<Next>', lambda event: self._move_selection(self._visible))
+
+    # Model
+
+    def set_rows(self, rows, formatter=None):
+        """Replace the whole model at once; `formatter` renders every non-string row"""
+        self._rows = list(rows)
+        self._formatter = formatter
+        self._top = 0
+        self._selected = None
+        self._schedule_render()
+
+    def extend(self, rows):
+        self._rows.extend(rows)
+        self._schedule_render()
+
+    def insert(self, index, *rows):
+        if index == tk.END:
+            self._rows.extend(rows)
+        else:
+            index = int(index)
+            self._rows[index:index] = rows
+        self._schedule_render()
+
+    def delete(self, first, last=None):
+        first = self._index(first)
+        last = first if last is None else self._index(last)
+        del self._rows[first:last + 1]
+        self._selected = None
+        self._top = min(self._top, self._max_top())
+        self._schedule_render()
+
+    def size(self):
+        return len(self._rows)
+
+    def get(self, index):
+        return self._text(self._rows[self._index(index)])
+
+    def curselection(self):
+        return () if self._selected is None else (self._selected,)
+
+    # Listbox passthrough
+
+    def config(self, **options):
+        self._listbox.config(**options)
+        if 'font' in options:
+            self._update_line_height()
+            self._schedule_render()
+
+    configure = config
+
+    def cget(self, option):
+        return self._listbox.cget(option)
+
+    def bind(self, sequence=None, func=None, add=None):
+        return self._listbox.bind(sequence, func, add)
+
+    # Scrolling
+
+    def yview(self, *args):
+        """Scrollbar protocol: ('moveto', fraction) or ('scroll', n, 'units'|'pages')"""
+        if args[0] == tk.MOVETO:
+            self.yview_moveto(float(args[1]))
+        elif args[0] == tk.SCROLL:
+            step = int(args[1]) * (self._visible if args[2] == tk.PAGES else 1)
+            self._scroll_by(step)
+
+    def yview_moveto(self, fraction):
+        self._top = self._clamp(round(fraction * len(self._rows)))
+        self._schedule_render()
+
+    def see(self, index):
+        index = self._index(index)
+        if index < self._top:
+            self._top = index
+        elif index >= self._top + self._visible:
+            self._top = self._clamp(index - self._visible + 1)
+        self._schedule_render()
+
+    def _scroll_by(self, rows):
+        self._top = self._clamp(self._top + rows)
+        self._schedule_render()
+        return "break"
+
+    def _on_mousewheel(self, event):
+        # Windows reports multiples of 120 per notch, macOS small deltas
+        delta = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self._scroll_by(-delta * 3)
+
+    def _move_selection(self, step):
+        if not self._rows:
+            return "break"
+        current = self._top if self._selected is None else self._selected
+        self._selected = max(0, min(len(self._rows) - 1, current + step))
+        self.see(self._selected)
+        return "break"
+
+    def _on_select(self, event):
+        selection = self._listbox.curselection()
+        if selection:
+            self._selected = self._top + selection[0]
+
+    def _on_configure(self, event):
+        chrome = 2 * (int(self._listbox.cget('borderwidth')) + int(self._listbox.cget('highlightthickness')))
+        visible = max(1, (event.height - chrome) // self._line_height)
+        if visible != self._visible:
+            self._visible = visible
+            self._top = self._clamp(self._top)
+            self._schedule_render()
+
+    # Rendering
+
+    def _schedule_render(self):
+        # Many model updates in one event-loop turn collapse into a single redraw
+        if not self._render_pending:
+            self._render_pending = True
+            self.after_idle(self._render)
+
+    def _render(self):
+        self._render_pending = False
+        end = min(len(self._rows), self._top + self._visible)
+        self._listbox.delete(0, tk.END)
+        self._listbox.insert(tk.END, *(self._text(row) for row in self._rows[self._top:end]))
+        if self._selected is not None and self._top <= self._selected < end:
+            self._listbox.selection_set(self._selected - self._top)
+        if self._rows:
+            self._scrollbar.set(self._top / len(self._rows), end / len(self._rows))
+        else:
+            self._scrollbar.set(0, 1)
+
+    def _text(self, row):
+        if isinstance(row, str) or self._formatter is None:
+            return str(row)
+        return self._formatter(row)
+
+    def _update_line_height(self):
+        self._line_height = max(1, tkfont.Font(font=self._listbox.cget('font')).metrics('linespace') + 1)
+
+    def _index(self, index):
+        if index == tk.END:
+            return len(self._rows) - 1
+        return int(index)
+
+    def _max_top(self):
+        return max(0, len(self._rows) - self._visible)
+
+    def _clamp(self, top):
+        return max(0, min(top, self._max_top()))